@@ -1,16 +1,30 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
 from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
 import uuid
 from datetime import datetime
+from bisect import bisect_left, bisect_right
 from google import genai
 import json
 from io import BytesIO
 from PIL import Image
 import base64
+import numpy as np
 import requests
+import threading
+import atexit
+import time
+import heapq
+import math
+import re
+import random
+import hashlib
+from functools import wraps
+from collections import Counter, OrderedDict, defaultdict
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
@@ -28,11 +42,1668 @@ def get_supabase():
     """Get Supabase client"""
     return supabase
 
+# ============================================
+# CONCURRENT SUPABASE CALLS
+# ============================================
+
+SUPABASE_IO_WORKERS = int(os.getenv('SUPABASE_IO_WORKERS', 8))
+_io_pool = ThreadPoolExecutor(max_workers=SUPABASE_IO_WORKERS, thread_name_prefix='supabase-io')
+_io_worker = threading.local()
+
+def _run_on_io_worker(call):
+    _io_worker.active = True
+    try:
+        return call()
+    finally:
+        _io_worker.active = False
+
+def run_concurrently(*calls, return_exceptions=False):
+    """
+    Run independent Supabase calls in parallel on a bounded thread pool
+    calls: zero-argument callables (must not touch the Flask request context)
+    Returns results in call order. Every call is waited for; then the first failure
+    (in call order) is re-raised, as running them one after another would surface it.
+    With return_exceptions=True, exceptions are returned in place of results instead.
+    The first call runs on the calling thread, so its own nested calls still fan out;
+    calls made from inside a pool worker run inline, so nesting cannot deadlock the pool.
+    """
+    if len(calls) <= 1 or getattr(_io_worker, 'active', False):
+        futures = None
+    else:
+        futures = [None] + [_io_pool.submit(_run_on_io_worker, call) for call in calls[1:]]
+
+    results = []
+    for index, call in enumerate(calls):
+        try:
+            results.append(futures[index].result() if futures and futures[index] else call())
+        except Exception as e:
+            if not return_exceptions:
+                if futures:
+                    for future in futures[index + 1:]:
+                        future.exception()  # Wait for the rest, as the sequential code did
+                raise
+            results.append(e)
+    return results
+
+# ============================================
+# SHARED PRODUCT HELPERS
+# ============================================
+
+RATING_STARS = (1, 2, 3, 4, 5)
+
+def _empty_rating_summary():
+    return {
+        'sum': 0,
+        'count': 0,
+        'average': 0.0,
+        'histogram': {str(star): 0 for star in RATING_STARS}
+    }
+
+def get_rating_summaries(product_ids):
+    """
+    Get rating summary (sum, count, average, 1-5 star histogram) for a batch of products
+    Reads the incrementally maintained product_rating_summaries table in a single `in_` query
+    Returns: { product_id: { 'sum', 'count', 'average', 'histogram' } } (unrounded average)
+    """
+    product_ids = list(dict.fromkeys(pid for pid in product_ids if pid))
+    summaries = {pid: _empty_rating_summary() for pid in product_ids}
+    if not product_ids:
+        return summaries
+
+    response = supabase.table('product_rating_summaries')\
+        .select('product_id, rating_sum, rating_count, star_1, star_2, star_3, star_4, star_5')\
+        .in_('product_id', product_ids)\
+        .execute()
+
+    for row in (response.data or []):
+        count = row.get('rating_count') or 0
+        total = row.get('rating_sum') or 0
+        summaries[row['product_id']] = {
+            'sum': total,
+            'count': count,
+            'average': total / count if count else 0.0,
+            'histogram': {str(star): row.get(f'star_{star}') or 0 for star in RATING_STARS}
+        }
+    return summaries
+
+def record_product_rating(product_id, rating):
+    """Apply one new review to the product's rating summary (atomic increment in the database)"""
+    supabase.rpc('increment_product_rating', {
+        'p_product_id': product_id,
+        'p_rating': int(rating)
+    }).execute()
+
+def get_rating_stats(product_ids):
+    """
+    Get average rating and review count for a batch of products
+    Returns: { product_id: { 'average': float, 'count': int } } (unrounded average)
+    """
+    summaries = get_rating_summaries(product_ids)
+    return {pid: {'average': s['average'], 'count': s['count']} for pid, s in summaries.items()}
+
+def get_average_ratings(product_ids, ndigits=1):
+    """
+    Get rounded average rating for a batch of products
+    Returns: { product_id: float } (0.0 for products without reviews)
+    """
+    stats = get_rating_stats(product_ids)
+    return {pid: round(s['average'], ndigits) if s['count'] else 0.0 for pid, s in stats.items()}
+
+def fetch_all_rows(build_query, page_size=1000):
+    """
+    Fetch every row of a query, paging past the PostgREST max-rows limit
+    build_query: callable returning a fresh (unexecuted) query builder
+    """
+    rows = []
+    offset = 0
+    while True:
+        batch = build_query().range(offset, offset + page_size - 1).execute().data or []
+        rows.extend(batch)
+        if len(batch) < page_size:
+            return rows
+        offset += page_size
+
+def as_value_list(value):
+    """Normalize a JSONB color/tags value (array, string or null) to a list"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [value] if value else []
+    return []
+
+def first_images(product, count=2):
+    """First `count` images of a product, falling back to the legacy single image_url"""
+    image_urls = product.get('image_urls', [])
+    if isinstance(image_urls, list) and image_urls:
+        return image_urls[:count]
+    single_image = product.get('image_url')
+    return [single_image] if single_image else []
+
+# Listing sort -> (column, descending)
+PRODUCT_SORTS = {
+    'newest': ('created_at', True),
+    'oldest': ('created_at', False),
+    'price_high_low': ('price', True),
+    'price_low_high': ('price', False),
+}
+
+# Generated (read-only) product columns, see product_filter_columns.sql
+PRODUCT_GENERATED_COLUMNS = ('color_lc', 'tags_lc')
+
+def without_generated_columns(product):
+    """Product row without the generated filter columns, for API responses"""
+    return {k: v for k, v in product.items() if k not in PRODUCT_GENERATED_COLUMNS}
+
+def parse_product_filters(args, default_sort='newest'):
+    """
+    Read the shared product listing filters from query params
+    Returns: dict with category, min_price, max_price, color, tag, status, search, sort
+    """
+    return {
+        'category': args.get('category') or None,
+        'min_price': args.get('min_price', type=float),
+        'max_price': args.get('max_price', type=float),
+        'color': args.get('color'),
+        'tag': args.get('tag'),
+        'status': args.get('status') or None,
+        'search': (args.get('search') or '').strip() or None,
+        'sort': args.get('sort', default_sort)
+    }
+
+def apply_product_filters(query, filters):
+    """
+    Compile listing filters into PostgREST predicates on the products table
+    Color/tag matching is array containment on the lowercase shadow columns,
+    so it runs in the database instead of in Python after the fetch
+    """
+    if filters.get('category'):
+        query = query.eq('category', filters['category'])
+    if filters.get('status'):
+        query = query.eq('status', filters['status'])
+    if filters.get('min_price') is not None:
+        query = query.gte('price', filters['min_price'])
+    if filters.get('max_price') is not None:
+        query = query.lte('price', filters['max_price'])
+    if filters.get('color') is not None:
+        query = query.contains('color_lc', [filters['color'].lower()])
+    if filters.get('tag') is not None:
+        query = query.contains('tags_lc', [filters['tag'].lower()])
+    if filters.get('search'):
+        query = query.ilike('name', f"%{filters['search']}%")
+    return query
+
+def apply_product_sort(query, sort):
+    """Order a products query by a listing sort, with id as the tie-breaker"""
+    column, desc = PRODUCT_SORTS.get(sort, PRODUCT_SORTS['newest'])
+    return query.order(column, desc=desc).order('id', desc=desc)
+
+def query_products(columns, filters, offset, limit):
+    """
+    Run one filtered, sorted, paginated products query with an exact count
+    Returns: (rows, total_count)
+    """
+    query = supabase.table('products').select(columns, count='exact')
+    query = apply_product_sort(apply_product_filters(query, filters), filters.get('sort'))
+    response = query.range(offset, offset + limit - 1).execute()
+    return response.data or [], response.count or 0
+
+def load_size_stocks(product_ids):
+    """
+    Size labels and stock for one or many products in a single embedded-select query
+    Returns: {product_id: [{row_id, size_label, stock}]} in size chart order;
+    every requested product is present (empty list when it has no sizes)
+    """
+    size_stocks = {pid: [] for pid in product_ids}
+    if not size_stocks:
+        return size_stocks
+    response = supabase.table('product_sizes')\
+        .select('product_id, size_chart_row_id, size_chart_rows(size_label, sort_order), product_size_stock(stock_quantity)')\
+        .in_('product_id', list(size_stocks))\
+        .execute()
+    
+    sort_orders = {}
+    for ps in (response.data or []):
+        row = ps.get('size_chart_rows')
+        if isinstance(row, list):
+            row = row[0] if row else None
+        if not row or not row.get('size_label'):  # Only sizes with a valid label
+            continue
+        stock = ps.get('product_size_stock')
+        if isinstance(stock, list):
+            stock = stock[0] if stock else None
+        sort_orders[(ps['product_id'], ps['size_chart_row_id'])] = row.get('sort_order') or 0
+        size_stocks.setdefault(ps['product_id'], []).append({
+            'row_id': ps['size_chart_row_id'],
+            'size_label': row['size_label'],
+            'stock': (stock or {}).get('stock_quantity', 0)
+        })
+    for pid, sizes in size_stocks.items():
+        sizes.sort(key=lambda size: sort_orders[(pid, size['row_id'])])
+    return size_stocks
+
+def encode_cursor(state):
+    """Opaque pagination cursor from a small JSON-serializable dict"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(state, dict):
+        raise ValueError('Invalid cursor')
+    return state
+
+# ============================================
+# PRODUCT SEARCH (in-process inverted index)
+# ============================================
+
+# Field weights for search ranking: a term in the name counts three times one in the description
+SEARCH_FIELD_BOOSTS = {'name': 3.0, 'category': 2.0, 'tags': 1.5, 'colors': 1.5, 'description': 1.0}
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_PREFIX_EXPANSIONS = 50  # Max index terms a type-ahead prefix expands to
+SEARCH_TYPO_MAX_EDITS = 2  # Edits allowed for words longer than 5 letters (1 for shorter ones)
+SEARCH_TYPO_MIN_LENGTH = 3  # Shorter words are never corrected
+SEARCH_TYPO_PREFIX = 7  # Deletions are generated from the first letters only, bounding the index
+
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+def tokenize(text):
+    """Lowercase word tokens of a search field or query"""
+    return _TOKEN_RE.findall(str(text or '').lower())
+
+def _deletes(word, max_edits):
+    """Every string obtained by deleting up to `max_edits` letters from a word (SymSpell)"""
+    found = {word}
+    frontier = {word}
+    for _ in range(max_edits):
+        frontier = {w[:k] + w[k + 1:] for w in frontier if len(w) > 1 for k in range(len(w))} - found
+        found |= frontier
+    return found
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance between a and b, or None if above max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)  # Transposition
+        if min(current) > max_distance:
+            return None
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+class ProductSearchIndex:
+    """
+    BM25F-style inverted index over product name, category, tags, colors and description
+    Per-field term frequencies are length-normalized, weighted by SEARCH_FIELD_BOOSTS and
+    folded into one score per (term, product) at build time, so a query only sums postings.
+    Documents are addressed by catalog snapshot position.
+    """
+
+    def __init__(self, documents):
+        field_tokens = []
+        total_length = dict.fromkeys(SEARCH_FIELD_BOOSTS, 0)
+        for document in documents:
+            tokens = {}
+            for field in SEARCH_FIELD_BOOSTS:
+                value = document.get(field)
+                if isinstance(value, (list, tuple, set, frozenset)):
+                    value = ' '.join(str(v) for v in value)
+                tokens[field] = tokenize(value)
+                total_length[field] += len(tokens[field])
+            field_tokens.append(tokens)
+        n = len(documents)
+        average_length = {field: (length / n if n else 0) or 1 for field, length in total_length.items()}
+
+        weighted = {}  # term -> {position: boosted, length-normalized term frequency}
+        for i, tokens in enumerate(field_tokens):
+            for field, boost in SEARCH_FIELD_BOOSTS.items():
+                terms = tokens[field]
+                if not terms:
+                    continue
+                norm = 1 - SEARCH_BM25_B + SEARCH_BM25_B * len(terms) / average_length[field]
+                for term, tf in Counter(terms).items():
+                    postings = weighted.setdefault(term, {})
+                    postings[i] = postings.get(i, 0) + boost * tf / norm
+
+        self.postings = {}  # term -> {position: score}
+        for term, postings in weighted.items():
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            self.postings[term] = {
+                i: idf * tf * (SEARCH_BM25_K1 + 1) / (tf + SEARCH_BM25_K1)
+                for i, tf in postings.items()
+            }
+        self.vocabulary = sorted(self.postings)
+        self._deletions = None  # delete -> vocabulary terms, built on the first correction
+
+    def expand(self, token, prefix=False):
+        """Index terms matching a query token (the token itself, or every term it prefixes)"""
+        if not prefix:
+            return [token] if token in self.postings else []
+        start = bisect_left(self.vocabulary, token)
+        terms = []
+        for term in self.vocabulary[start:start + SEARCH_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            terms.append(term)
+        return terms
+
+    def deletions(self):
+        """SymSpell deletion index over the vocabulary (prefix of each term, up to SEARCH_TYPO_MAX_EDITS deletes)"""
+        if self._deletions is None:
+            deletions = defaultdict(list)
+            for term in self.vocabulary:
+                if len(term) >= SEARCH_TYPO_MIN_LENGTH and not term.isdigit():
+                    for deleted in _deletes(term[:SEARCH_TYPO_PREFIX], SEARCH_TYPO_MAX_EDITS):
+                        deletions[deleted].append(term)
+            self._deletions = dict(deletions)
+        return self._deletions
+
+    def correct_token(self, token):
+        """
+        Closest vocabulary term to a misspelled token, or None
+        Candidates come from deletion-index lookups, so only a handful of terms are
+        compared with the token instead of the whole vocabulary. Ties prefer the term
+        found in more products.
+        """
+        if len(token) < SEARCH_TYPO_MIN_LENGTH or token.isdigit():
+            return None
+        max_edits = 1 if len(token) <= 5 else SEARCH_TYPO_MAX_EDITS
+        deletions = self.deletions()
+        candidates = set()
+        for deleted in _deletes(token[:SEARCH_TYPO_PREFIX], max_edits):
+            candidates.update(deletions.get(deleted, ()))
+        best = None
+        for term in candidates:
+            distance = edit_distance(token, term, max_edits)
+            if distance is not None:
+                rank = (distance, -len(self.postings[term]), term)
+                if best is None or rank < best:
+                    best = rank
+        return best[2] if best else None
+
+    def correct(self, query):
+        """
+        Query with every unknown word replaced by its closest vocabulary term
+        The last word counts as known if it prefixes a term (the user may still be typing).
+        Returns: corrected query, or None when nothing needed (or could be) corrected
+        """
+        tokens = tokenize(query)
+        corrected = []
+        for k, token in enumerate(tokens):
+            if not self.expand(token, prefix=k == len(tokens) - 1):
+                token = self.correct_token(token) or token
+            corrected.append(token)
+        return ' '.join(corrected) if corrected != tokens else None
+
+    def search(self, query, bits=None):
+        """
+        Score the products matching every query token (the last one as a prefix, for type-ahead)
+        bits: optional bitmap of the positions allowed to match
+        Returns: {position: score}
+        """
+        tokens = tokenize(query)
+        scores = None
+        for k, token in enumerate(tokens):
+            matched = {}
+            for term in self.expand(token, prefix=k == len(tokens) - 1):
+                for i, score in self.postings[term].items():
+                    if score > matched.get(i, 0):  # Best expansion per product
+                        matched[i] = score
+            if scores is None:
+                scores = matched if bits is None else {i: s for i, s in matched.items() if bits >> i & 1}
+            else:
+                scores = {i: s + matched[i] for i, s in scores.items() if i in matched}
+            if not scores:
+                return {}
+        return scores or {}
+
+# ============================================
+# CATALOG SNAPSHOT (in-process read model)
+# ============================================
+
+CATALOG_SNAPSHOT_TTL = int(os.getenv('CATALOG_SNAPSHOT_TTL', 300))  # seconds, catches out-of-band edits
+CATALOG_COLUMNS = 'id, name, price, created_at, status, category, color, tags, description, image_urls, image_url'
+# Lower edges of the facet price buckets; the last bucket is open-ended
+FACET_PRICE_EDGES = tuple(float(edge) for edge in os.getenv('FACET_PRICE_EDGES', '0,500,1000,2000,5000').split(','))
+
+def _set_bit(index, key, position):
+    index[key] = index.get(key, 0) | (1 << position)
+
+class CatalogSnapshot:
+    """
+    Immutable, array-backed view of the product catalog for the listing endpoints
+    Product i is described by position i of every column list. A new snapshot is built
+    and swapped in on product writes, so readers never see a half-updated catalog.
+    Filters are answered from inverted indexes mapping each normalized category, status,
+    color and tag to a bitmap (Python int, bit i = position i) of matching products.
+    """
+
+    def __init__(self, products, rating_stats):
+        self.built_at = time.time()
+        self.ids = []
+        self.names = []
+        self.prices = []
+        self.created_at = []
+        self.category_codes = []
+        self.colors = []  # Original colors, for display
+        self.color_sets = []  # Lowercase, for matching
+        self.tag_sets = []
+        self.images = []
+        self.ratings = []
+        self.rating_counts = []
+        self.categories = []  # category code -> category name
+        self.category_lookup = {}  # category name -> category code
+        self.position = {}  # product id -> position
+        self.color_labels = {}  # lowercase color -> first spelling seen, for facet labels
+        self._tag_pools = {}  # tag substring -> positions, see tag_pool()
+        self._price_buckets = {}  # price edges -> bucket bitmaps, see price_bucket_bits()
+
+        # Inverted indexes: value -> bitmap of positions
+        self.category_index = {}  # category code -> bitmap
+        self.status_index = {}
+        self.color_index = {}
+        self.tag_index = {}
+        search_documents = []
+
+        for product in products:
+            category = product.get('category')
+            if category not in self.category_lookup:
+                self.category_lookup[category] = len(self.categories)
+                self.categories.append(category)
+            colors = as_value_list(product.get('color'))
+            tags = frozenset(str(t).lower() for t in as_value_list(product.get('tags')))
+            i = len(self.ids)
+
+            self.position[product['id']] = i
+            self.ids.append(product['id'])
+            self.names.append(product.get('name', ''))
+            self.prices.append(float(product.get('price') or 0))
+            self.created_at.append(product.get('created_at') or '')
+            self.category_codes.append(self.category_lookup[category])
+            self.colors.append(colors)
+            self.color_sets.append(frozenset(str(c).lower() for c in colors))
+            self.tag_sets.append(tags)
+            self.images.append(first_images(product))
+            stats = rating_stats.get(product['id']) or {'average': 0.0, 'count': 0}
+            self.ratings.append(stats['average'])
+            self.rating_counts.append(stats['count'])
+
+            _set_bit(self.category_index, self.category_codes[i], i)
+            _set_bit(self.status_index, product.get('status'), i)
+            for c in colors:
+                self.color_labels.setdefault(str(c).lower(), str(c))
+            for c in self.color_sets[i]:
+                _set_bit(self.color_index, c, i)
+            for t in tags:
+                _set_bit(self.tag_index, t, i)
+            search_documents.append({
+                'name': self.names[i],
+                'category': category,
+                'tags': tags,
+                'colors': colors,
+                'description': product.get('description')
+            })
+
+        self.all_bits = (1 << len(self.ids)) - 1
+        self.search_index = ProductSearchIndex(search_documents)
+
+        # Precomputed orderings (positions, ascending by (sort key, id)) and their keys
+        positions = range(len(self.ids))
+        self.by_created = sorted(positions, key=lambda i: (self.created_at[i], self.ids[i]))
+        self.created_keys = [(self.created_at[i], self.ids[i]) for i in self.by_created]
+        self.by_price = sorted(positions, key=lambda i: (self.prices[i], self.ids[i]))
+        self.price_keys = [(self.prices[i], self.ids[i]) for i in self.by_price]
+        self.sorted_prices = [self.prices[i] for i in self.by_price]
+        # Rating ranking (average, then review count); replaced as a whole when a review lands
+        by_rating = sorted(positions, key=lambda i: self.rating_key(i))
+        self.rating_ranking = (by_rating, [self.rating_key(i) for i in by_rating])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def is_stale(self):
+        return time.time() - self.built_at > CATALOG_SNAPSHOT_TTL
+
+    def filter(self, category=None, min_price=None, max_price=None, color=None, tag=None, status='active'):
+        """Bitmap of positions matching all given filters (None means no filter)"""
+        bits = self.all_bits
+        if status is not None:
+            bits &= self.status_index.get(status, 0)
+        if category is not None:
+            bits &= self.category_index.get(self.category_lookup.get(category), 0)
+        if color is not None:
+            bits &= self.color_index.get(color.lower(), 0)
+        if tag is not None:
+            bits &= self.tag_index.get(tag.lower(), 0)
+        if bits and (min_price is not None or max_price is not None):
+            bits &= self.price_bits(min_price, max_price)
+        return bits
+
+    def price_bits(self, min_price=None, max_price=None):
+        """Bitmap of positions with min_price <= price <= max_price"""
+        lo = bisect_left(self.sorted_prices, min_price) if min_price is not None else 0
+        hi = bisect_right(self.sorted_prices, max_price) if max_price is not None else len(self.sorted_prices)
+        bits = 0
+        for i in self.by_price[lo:hi]:
+            bits |= 1 << i
+        return bits
+
+    def price_bucket_bits(self, edges):
+        """Bitmap per price bucket [edges[k], edges[k+1]), the last one open-ended; cached per snapshot"""
+        buckets = self._price_buckets.get(edges)
+        if buckets is None:
+            bounds = [bisect_left(self.sorted_prices, edge) for edge in edges] + [len(self.sorted_prices)]
+            buckets = []
+            for lo, hi in zip(bounds, bounds[1:]):
+                bits = 0
+                for i in self.by_price[lo:hi]:
+                    bits |= 1 << i
+                buckets.append(bits)
+            self._price_buckets[edges] = buckets
+        return buckets
+
+    def facets(self, category=None, min_price=None, max_price=None, color=None, tag=None,
+               price_edges=FACET_PRICE_EDGES, status='active'):
+        """
+        Counts per category, color, tag and price bucket for a filter set
+        Each facet is counted against every filter except its own, so the sidebar
+        can show how many products each alternative value would return.
+        """
+        everything = self.all_bits
+        status_bits = self.status_index.get(status, 0) if status is not None else everything
+        category_bits = self.category_index.get(self.category_lookup.get(category), 0) if category is not None else everything
+        color_bits = self.color_index.get(color.lower(), 0) if color is not None else everything
+        tag_bits = self.tag_index.get(tag.lower(), 0) if tag is not None else everything
+        price_bits = self.price_bits(min_price, max_price) if min_price is not None or max_price is not None else everything
+
+        def counts(base, index, label):
+            result = {}
+            for key, bits in index.items():
+                n = self.count(base & bits)
+                value = label(key)
+                if n and value not in (None, ''):
+                    result[value] = n
+            return result
+
+        base = status_bits & color_bits & tag_bits & price_bits
+        categories = counts(base, self.category_index, lambda code: self.categories[code])
+        base = status_bits & category_bits & tag_bits & price_bits
+        colors = counts(base, self.color_index, lambda c: self.color_labels.get(c, c))
+        base = status_bits & category_bits & color_bits & price_bits
+        tags = counts(base, self.tag_index, lambda t: t)
+
+        base = status_bits & category_bits & color_bits & tag_bits
+        price_buckets = []
+        for k, bits in enumerate(self.price_bucket_bits(price_edges)):
+            price_buckets.append({
+                'min': price_edges[k],
+                'max': price_edges[k + 1] if k + 1 < len(price_edges) else None,
+                'count': self.count(base & bits)
+            })
+
+        return {
+            'total': self.count(base & price_bits),
+            'categories': categories,
+            'colors': colors,
+            'tags': tags,
+            'price_buckets': price_buckets
+        }
+
+    @staticmethod
+    def count(bits):
+        return bin(bits).count('1')
+
+    def _sort_spec(self, sort):
+        """(ascending order, its keys, descending?) for a listing sort"""
+        if sort == 'rating_high_low':
+            by_rating, rating_keys = self.rating_ranking
+            return by_rating, rating_keys, True
+        if sort == 'price_low_high':
+            return self.by_price, self.price_keys, False
+        if sort == 'price_high_low':
+            return self.by_price, self.price_keys, True
+        if sort == 'oldest':
+            return self.by_created, self.created_keys, False
+        return self.by_created, self.created_keys, True  # newest
+
+    def rating_key(self, i):
+        return (self.ratings[i], self.rating_counts[i], self.ids[i])
+
+    def sort_key(self, i, sort='newest'):
+        """Keyset (sort key, id) of position i under a listing sort"""
+        if sort == 'rating_high_low':
+            return self.rating_key(i)
+        if sort in ('price_low_high', 'price_high_low'):
+            return (self.prices[i], self.ids[i])
+        return (self.created_at[i], self.ids[i])
+
+    def ordered(self, bits, sort='newest', limit=None, after=None):
+        """
+        Positions in a bitmap, ordered by one of the listing sort keys
+        limit: return the first `limit` positions only
+        after: keyset (sort key, id) to resume after, as produced by sort_key()
+        """
+        order, keys, descending = self._sort_spec(sort)
+        if descending:
+            start = len(keys) if after is None else bisect_left(keys, tuple(after))
+            indexes = range(start - 1, -1, -1)
+        else:
+            start = 0 if after is None else bisect_right(keys, tuple(after))
+            indexes = range(start, len(order))
+        positions = []
+        if limit is not None and limit <= 0:
+            return positions
+        for idx in indexes:
+            i = order[idx]
+            if bits >> i & 1:
+                positions.append(i)
+                if limit is not None and len(positions) >= limit:
+                    break
+        return positions
+
+    def tag_pool(self, needle):
+        """
+        Positions of active products with a tag containing `needle` (lowercase substring)
+        Computed once per snapshot and cached, so homepage sampling never scans the catalog
+        """
+        pool = self._tag_pools.get(needle)
+        if pool is None:
+            bits = 0
+            for tag, tag_bits in self.tag_index.items():
+                if needle in tag:
+                    bits |= tag_bits
+            bits &= self.status_index.get('active', 0)
+            pool = tuple(i for i in range(len(self.ids)) if bits >> i & 1)
+            self._tag_pools[needle] = pool
+        return pool
+
+    def card(self, i, ndigits=1):
+        """Listing card for position i"""
+        return {
+            'id': self.ids[i],
+            'name': self.names[i],
+            'rating': round(self.ratings[i], ndigits),
+            'image': self.images[i],
+            'price': self.prices[i]
+        }
+
+    def set_rating(self, product_id, rating, count):
+        """Update one product's rating and move it within the rating ranking"""
+        i = self.position.get(product_id)
+        if i is None:
+            return
+        by_rating, rating_keys = self.rating_ranking
+        by_rating, rating_keys = list(by_rating), list(rating_keys)
+        old = bisect_left(rating_keys, self.rating_key(i))
+        del by_rating[old]
+        del rating_keys[old]
+        self.ratings[i] = rating
+        self.rating_counts[i] = count
+        new_key = self.rating_key(i)
+        new = bisect_left(rating_keys, new_key)
+        by_rating.insert(new, i)
+        rating_keys.insert(new, new_key)
+        self.rating_ranking = (by_rating, rating_keys)  # Readers see the old or the new ranking, never a mix
+
+_catalog_snapshot = None
+_catalog_lock = threading.Lock()
+
+def build_catalog_snapshot():
+    """Load products and their rating summaries from Supabase into a new snapshot"""
+    products, summaries = run_concurrently(
+        lambda: fetch_all_rows(lambda: supabase.table('products')
+                               .select(CATALOG_COLUMNS)
+                               .order('id')),
+        lambda: fetch_all_rows(lambda: supabase.table('product_rating_summaries')
+                               .select('product_id, rating_sum, rating_count')
+                               .order('product_id'))
+    )
+    rating_stats = {}
+    for row in summaries:
+        count = row.get('rating_count') or 0
+        rating_stats[row['product_id']] = {
+            'average': (row.get('rating_sum') or 0) / count if count else 0.0,
+            'count': count
+        }
+    return CatalogSnapshot(products, rating_stats)
+
+def get_catalog_snapshot():
+    """Current catalog snapshot, (re)built on first use or after the TTL"""
+    global _catalog_snapshot
+    snapshot = _catalog_snapshot
+    if snapshot is not None and not snapshot.is_stale():
+        return snapshot
+    with _catalog_lock:
+        if _catalog_snapshot is None or _catalog_snapshot.is_stale():
+            _catalog_snapshot = build_catalog_snapshot()
+        return _catalog_snapshot
+
+def refresh_catalog_snapshot():
+    """Rebuild and atomically swap the catalog snapshot after a product write"""
+    global _catalog_snapshot
+    with _catalog_lock:
+        try:
+            _catalog_snapshot = build_catalog_snapshot()
+        except Exception as e:
+            print(f"Warning: Could not refresh catalog snapshot: {e}")
+            _catalog_snapshot = None  # Next read rebuilds
+
+CATALOG_RATING_PATCH_LIMIT = 50  # More changed ratings than this rebuild the snapshot instead
+
+def refresh_catalog_rating(product_id):
+    """Push a product's latest rating summary into the live snapshot and its rating ranking"""
+    if _catalog_snapshot is not None:
+        refresh_catalog_ratings(get_rating_stats([product_id]))
+
+def refresh_catalog_ratings(rating_stats):
+    """
+    Push new ratings ({product_id: {'average', 'count'}}) into the live snapshot
+    Each update re-sorts the rating ranking, so large batches rebuild the snapshot once instead
+    """
+    snapshot = _catalog_snapshot
+    if snapshot is None:
+        return
+    if len(rating_stats) > CATALOG_RATING_PATCH_LIMIT:
+        refresh_catalog_snapshot()
+        return
+    with _catalog_lock:
+        for product_id, stats in rating_stats.items():
+            snapshot.set_rating(product_id, stats['average'], stats['count'])
+
+def sample_tag_pool(catalog, needle, count, rotation=None):
+    """
+    Pick `count` random positions from a tag pool (all of them if the pool is smaller)
+    rotation: window in seconds; samples are seeded by the window so every request
+    (and every worker) in the same window gets the same products
+    """
+    pool = catalog.tag_pool(needle)
+    if len(pool) <= count:
+        return list(pool)
+    if rotation and rotation > 0:
+        rng = random.Random(f"{needle}:{int(time.time() // rotation)}")
+        return rng.sample(pool, count)
+    return random.sample(pool, count)
+
+def rotation_cache_headers(rotation):
+    """Cache-Control letting browsers/edge caches keep a rotated sample until its window ends"""
+    if not rotation or rotation <= 0:
+        return {}
+    remaining = rotation - int(time.time()) % rotation
+    return {'Cache-Control': f'public, max-age={remaining}'}
+
+def page_catalog(catalog, bits, sort, page, limit, cursor=None, ranked=None):
+    """
+    One page of a catalog listing, addressed by page number or by keyset cursor
+    ranked: full precomputed ordering, for sorts the snapshot has no keyset order for
+    Returns: (positions, offset, next_cursor); raises ValueError for a bad cursor
+    """
+    total = catalog.count(bits)
+    if cursor:
+        state = decode_cursor(cursor)
+        if state.get('sort') != sort:
+            raise ValueError('Cursor does not match sort')
+        offset = int(state.get('n', 0))
+        if ranked is not None:
+            last = catalog.position.get(state.get('id'))
+            start = ranked.index(last) + 1 if last in ranked else offset
+            positions = ranked[start:start + limit]
+        else:
+            positions = catalog.ordered(bits, sort, limit=limit, after=state.get('key'))
+    else:
+        offset = (page - 1) * limit
+        if ranked is not None:
+            positions = ranked[offset:offset + limit]
+        else:
+            positions = catalog.ordered(bits, sort, limit=offset + limit)[offset:]
+
+    next_cursor = None
+    if positions and offset + len(positions) < total:
+        last = positions[-1]
+        next_cursor = encode_cursor({
+            'sort': sort,
+            'key': None if ranked is not None else list(catalog.sort_key(last, sort)),
+            'id': catalog.ids[last],
+            'n': offset + len(positions)
+        })
+    return positions, offset, next_cursor
+
+# ============================================
+# SALES COUNTERS (best-selling ranking)
+# ============================================
+
+SALES_TOP_K = int(os.getenv('SALES_TOP_K', 50))
+SALES_COUNTERS_TTL = int(os.getenv('SALES_COUNTERS_TTL', 300))  # seconds, picks up other workers' orders
+
+class SalesCounters:
+    """
+    In-process copy of product_sales_counters (product_id -> units sold)
+    Keeps the K best sellers sorted, so "top N sellers" for N <= K is an O(N) read
+    """
+
+    def __init__(self, counts, top_k=SALES_TOP_K):
+        self.loaded_at = time.time()
+        self.counts = dict(counts)
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._rebuild_top()
+
+    def _rebuild_top(self):
+        best = heapq.nlargest(self.top_k, self.counts.items(), key=lambda item: item[1])
+        self.top_items = [(pid, units) for pid, units in best if units > 0]
+
+    def is_stale(self):
+        return time.time() - self.loaded_at > SALES_COUNTERS_TTL
+
+    def get(self, product_id):
+        return self.counts.get(product_id, 0)
+
+    def set(self, product_id, units):
+        """Store a product's new total and keep the top-K list in order"""
+        with self._lock:
+            old_units = self.counts.get(product_id, 0)
+            self.counts[product_id] = units
+            in_top = any(pid == product_id for pid, _ in self.top_items)
+            floor = self.top_items[-1][1] if len(self.top_items) >= self.top_k else 0
+            if in_top and units < old_units:
+                self._rebuild_top()  # A product outside the list may now rank higher
+            elif in_top or units > floor:
+                top = [(pid, u) for pid, u in self.top_items if pid != product_id]
+                if units > 0:
+                    top.append((product_id, units))
+                top.sort(key=lambda item: item[1], reverse=True)
+                self.top_items = top[:self.top_k]
+
+    def top(self, n):
+        """[(product_id, units_sold)] for the n best sellers"""
+        if n <= self.top_k:
+            return self.top_items[:n]
+        best = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+        return [(pid, units) for pid, units in best if units > 0]
+
+_sales_counters = None
+_sales_lock = threading.Lock()
+
+def load_sales_counters():
+    rows = fetch_all_rows(lambda: supabase.table('product_sales_counters')
+                          .select('product_id, units_sold')
+                          .order('product_id'))
+    return SalesCounters({r['product_id']: r.get('units_sold') or 0 for r in rows})
+
+def get_sales_counters():
+    """Current sales counters, (re)loaded on first use or after the TTL"""
+    global _sales_counters
+    counters = _sales_counters
+    if counters is not None and not counters.is_stale():
+        return counters
+    with _sales_lock:
+        if _sales_counters is None or _sales_counters.is_stale():
+            _sales_counters = load_sales_counters()
+        return _sales_counters
+
+def record_order_sales(order_id, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) an order's items from the sales counters
+    The database applies the change atomically and returns the new per-product totals
+    """
+    response = supabase.rpc('apply_order_sales', {'p_order_id': order_id, 'p_sign': sign}).execute()
+    store_sales_totals(response.data)
+
+def store_sales_totals(rows):
+    """Apply new per-product totals returned by the database to the in-process counters"""
+    counters = _sales_counters
+    if counters is not None:
+        for row in (rows or []):
+            counters.set(row['product_id'], row.get('units_sold') or 0)
+
+def reset_sales_counters():
+    global _sales_counters
+    with _sales_lock:
+        _sales_counters = None
+
+# ============================================
+# SEARCH SUGGESTIONS (typeahead)
+# ============================================
+
+SUGGEST_TOP_N = int(os.getenv('SUGGEST_TOP_N', 10))  # Completions kept per prefix node
+SUGGEST_MAX_PREFIX = int(os.getenv('SUGGEST_MAX_PREFIX', 12))  # Longer prefixes fall back to bisect
+SUGGEST_INDEX_TTL = int(os.getenv('SUGGEST_INDEX_TTL', 300))  # seconds, refreshes the sales ranking
+
+class SuggestIndex:
+    """
+    Typeahead completions over active product names and categories
+    Every word of a name starts a key ("blue cotton shirt", "cotton shirt", "shirt"), so a
+    prefix matches from any word. Entries are ranked once (units sold, then rating) and each
+    prefix up to SUGGEST_MAX_PREFIX characters keeps its SUGGEST_TOP_N best entries, so a
+    lookup is one dict read. Longer prefixes bisect the sorted key array instead.
+    """
+
+    def __init__(self, catalog, sales):
+        active = catalog.status_index.get('active', 0)
+        candidates = []  # (rank key, entry)
+        category_stats = {}  # category -> [units sold, product count]
+        for i in range(len(catalog)):
+            if not active >> i & 1:
+                continue
+            units = sales.get(catalog.ids[i])
+            candidates.append(((units, catalog.ratings[i], catalog.rating_counts[i]),
+                               {'type': 'product', 'text': catalog.names[i], 'id': catalog.ids[i]}))
+            category = catalog.categories[catalog.category_codes[i]]
+            if category:
+                stats = category_stats.setdefault(category, [0, 0])
+                stats[0] += units
+                stats[1] += 1
+        for category, (units, count) in category_stats.items():
+            candidates.append(((units, 0, count), {'type': 'category', 'text': category}))
+
+        # Best first, so an entry's index is its rank
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        self.entries = []
+        seen = set()
+        for _, entry in candidates:
+            text = (entry['type'], ' '.join(tokenize(entry['text'])))
+            if text not in seen:  # Same-named products suggest once, as the best ranked one
+                seen.add(text)
+                self.entries.append(entry)
+
+        keys = []  # (key, entry index)
+        nodes = defaultdict(set)
+        for e, entry in enumerate(self.entries):
+            words = tokenize(entry['text'])
+            for w in range(len(words)):
+                key = ' '.join(words[w:])
+                keys.append((key, e))
+                for length in range(1, min(len(key), SUGGEST_MAX_PREFIX) + 1):
+                    nodes[key[:length]].add(e)
+        keys.sort()
+        self.keys = keys
+        self.nodes = {prefix: tuple(heapq.nsmallest(SUGGEST_TOP_N, ranked)) for prefix, ranked in nodes.items()}
+        self.built_at = time.time()
+        self.catalog = catalog
+
+    def is_stale(self, catalog):
+        return self.catalog is not catalog or time.time() - self.built_at > SUGGEST_INDEX_TTL
+
+    def complete(self, prefix, limit=SUGGEST_TOP_N):
+        """Best `limit` entries (limit <= SUGGEST_TOP_N) with a key starting with `prefix`"""
+        prefix = ' '.join(tokenize(prefix)) + (' ' if prefix[-1:].isspace() else '')
+        if not prefix.strip():
+            return []
+        if len(prefix) <= SUGGEST_MAX_PREFIX:
+            ranked = self.nodes.get(prefix, ())
+        else:
+            found = set()
+            for n in range(bisect_left(self.keys, (prefix,)), len(self.keys)):
+                key, e = self.keys[n]
+                if not key.startswith(prefix):
+                    break
+                found.add(e)
+            ranked = sorted(found)
+        return [self.entries[e] for e in ranked[:limit]]
+
+_suggest_index = None
+_suggest_lock = threading.Lock()
+
+def get_suggest_index():
+    """Typeahead index for the current catalog snapshot, rebuilt when the snapshot changes"""
+    global _suggest_index
+    catalog = get_catalog_snapshot()
+    index = _suggest_index
+    if index is not None and not index.is_stale(catalog):
+        return index
+    with _suggest_lock:
+        if _suggest_index is None or _suggest_index.is_stale(catalog):
+            _suggest_index = SuggestIndex(catalog, get_sales_counters())
+        return _suggest_index
+
+# ============================================
+# RELATED PRODUCTS (precomputed similarity neighbors)
+# ============================================
+
+RELATED_TOP_K = int(os.getenv('RELATED_TOP_K', 12))  # Neighbors stored per product
+RELATED_BLOCK_ROWS = 512  # Similarity rows computed per block, bounds memory to block x catalog
+RELATED_WRITE_BATCH = 200  # Products per replace_product_neighbors call
+# Weight of each similarity component; they sum to 1 so scores stay in [0, 1]
+RELATED_WEIGHTS = {'category': 0.4, 'tags': 0.25, 'colors': 0.15, 'price': 0.2}
+RELATED_PRICE_SCALE = 0.5  # Price similarity halves every ~0.35 in log price (about 1.4x)
+
+def _indicator_matrix(value_sets, min_products=2):
+    """Row-normalized product x value indicator matrix (values shared by fewer products are dropped)"""
+    counts = Counter(v for values in value_sets for v in values)
+    columns = {v: k for k, v in enumerate(v for v, n in counts.items() if n >= min_products)}
+    matrix = np.zeros((len(value_sets), max(len(columns), 1)), dtype=np.float32)
+    for i, values in enumerate(value_sets):
+        for v in values:
+            if v in columns:
+                matrix[i, columns[v]] = 1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+class ProductSimilarity:
+    """
+    Content similarity between catalog snapshot positions, vectorized with NumPy
+    score = weighted sum of same category, tag and color cosine similarity and price
+    closeness (exp(-|log price difference| / RELATED_PRICE_SCALE)). Only active
+    products are candidates.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.categories = np.array(catalog.category_codes, dtype=np.int64)
+        self.tags = _indicator_matrix(catalog.tag_sets)
+        self.colors = _indicator_matrix(catalog.color_sets)
+        self.log_prices = np.log1p(np.maximum(np.array(catalog.prices, dtype=np.float64), 0))
+        active = catalog.status_index.get('active', 0)
+        self.active = np.array([bool(active >> i & 1) for i in range(len(catalog))], dtype=bool)
+
+    def neighbors(self, positions, k=RELATED_TOP_K):
+        """Top-k [(position, score)] for each of `positions`, best first"""
+        positions = list(positions)
+        result = []
+        for start in range(0, len(positions), RELATED_BLOCK_ROWS):
+            rows = np.array(positions[start:start + RELATED_BLOCK_ROWS], dtype=np.int64)
+            scores = RELATED_WEIGHTS['category'] * (self.categories[rows][:, None] == self.categories[None, :])
+            scores = scores + RELATED_WEIGHTS['tags'] * (self.tags[rows] @ self.tags.T)
+            scores = scores + RELATED_WEIGHTS['colors'] * (self.colors[rows] @ self.colors.T)
+            price_gap = np.abs(self.log_prices[rows][:, None] - self.log_prices[None, :])
+            scores = scores + RELATED_WEIGHTS['price'] * np.exp(-price_gap / RELATED_PRICE_SCALE)
+            scores[:, ~self.active] = -np.inf
+            scores[np.arange(len(rows)), rows] = -np.inf  # Never your own neighbor
+
+            n = min(k, max(int(self.active.sum()) - 1, 0))
+            if n == 0:
+                result.extend([] for _ in rows)
+                continue
+            top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            for r in range(len(rows)):
+                best = sorted(top[r], key=lambda j: (-scores[r, j], self.catalog.ids[j]))
+                result.append([(int(j), float(scores[r, j])) for j in best if np.isfinite(scores[r, j])])
+        return result
+
+_product_similarity = None
+_similarity_lock = threading.Lock()
+
+def get_product_similarity():
+    """Similarity model for the current catalog snapshot, rebuilt when the snapshot changes"""
+    global _product_similarity
+    catalog = get_catalog_snapshot()
+    model = _product_similarity
+    if model is not None and model.catalog is catalog:
+        return model
+    with _similarity_lock:
+        if _product_similarity is None or _product_similarity.catalog is not catalog:
+            _product_similarity = ProductSimilarity(catalog)
+        return _product_similarity
+
+def rebuild_product_neighbors(product_ids=None):
+    """
+    Recompute and store the neighbor lists of some products (all active products if None)
+    Returns: number of products whose neighbors were stored
+    """
+    model = get_product_similarity()
+    catalog = model.catalog
+    if product_ids is None:
+        positions = [i for i in range(len(catalog)) if model.active[i]]
+    else:
+        positions = [catalog.position[pid] for pid in product_ids if pid in catalog.position]
+    for start in range(0, len(positions), RELATED_WRITE_BATCH):
+        batch = positions[start:start + RELATED_WRITE_BATCH]
+        rows = []
+        for i, neighbors in zip(batch, model.neighbors(batch)):
+            for rank, (j, score) in enumerate(neighbors):
+                rows.append({
+                    'product_id': catalog.ids[i],
+                    'rank': rank,
+                    'neighbor_id': catalog.ids[j],
+                    'score': round(score, 4)
+                })
+        supabase.rpc('replace_product_neighbors', {
+            'p_product_ids': [catalog.ids[i] for i in batch],
+            'p_rows': rows
+        }).execute()
+    return len(positions)
+
+def product_neighbor_referrers(product_id):
+    """
+    Products whose stored neighbor lists include product_id (product_neighbors_neighbor_idx)
+    Read these before deleting a product: the delete cascades to their neighbor rows.
+    """
+    response = supabase.table('product_neighbors').select('product_id').eq('neighbor_id', product_id).execute()
+    return [row['product_id'] for row in (response.data or [])]
+
+def product_neighbor_dependents(product_id, referrers=None):
+    """
+    Products whose neighbor lists a write to product_id can change: the product itself,
+    the products whose stored lists include it (referrers, read now if None) and its
+    new top-K neighbors, whose lists it may now enter. Other products it now outranks
+    are caught by the next full rebuild.
+    """
+    if referrers is None:
+        referrers = product_neighbor_referrers(product_id)
+    product_ids = {product_id: None}
+    product_ids.update((referrer, None) for referrer in referrers)
+    model = get_product_similarity()
+    i = model.catalog.position.get(product_id)
+    if i is not None and model.active[i]:
+        product_ids.update((model.catalog.ids[j], None) for j, _ in model.neighbors([i])[0])
+    return list(product_ids)
+
+# ============================================
+# SESSION CART STORE (write-behind cache)
+# ============================================
+
+CART_CACHE_TTL = int(os.getenv('CART_CACHE_TTL', 120))  # seconds, bounds staleness from other workers
+CART_FLUSH_DELAY = float(os.getenv('CART_FLUSH_DELAY', 0.5))  # seconds, coalescing window for quantity changes
+CART_CACHE_MAX_SESSIONS = int(os.getenv('CART_CACHE_MAX_SESSIONS', 10000))
+CART_FLUSH_RETRY_DELAY = float(os.getenv('CART_FLUSH_RETRY_DELAY', 5))  # seconds, between failed write attempts
+
+class SessionCart:
+    def __init__(self, items):
+        self.items = items  # Formatted cart lines (see format_cart_item), newest first
+        self.pending = {}  # cart item id -> quantity not yet written
+        self.loaded_at = time.time()
+        self.timer = None
+        self.flush_lock = threading.Lock()  # Held while pending quantities are being written
+
+class CartStore:
+    """
+    Write-behind, in-process cache of session carts
+    get_cart is served from memory. Quantity changes update memory at once and are
+    written CART_FLUSH_DELAY later, so a burst of +/- clicks becomes one write per line.
+    Paths that need the database view of a cart (adds, removals, checkout) flush first.
+    Every drop bumps the session's generation, so a load that read the database before a
+    direct write cannot cache what it read (see generation() and put()).
+    """
+
+    def __init__(self):
+        self.carts = OrderedDict()  # session id -> SessionCart, least recently used first
+        self.item_sessions = {}  # cart item id -> session id
+        self.generations = OrderedDict()  # session id -> sequence number of its last drop
+        self.generation_floor = 0  # Generation of sessions no longer in self.generations
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """Cached lines of a session's cart, or None if not cached (or expired)"""
+        with self.lock:
+            cart = self.carts.get(session_id)
+            if cart is None:
+                return None
+            if time.time() - cart.loaded_at > CART_CACHE_TTL and not cart.pending:
+                self._remove(session_id)
+                return None
+            self.carts.move_to_end(session_id)
+            return [dict(item) for item in cart.items]
+
+    def generation(self, session_id):
+        """Read before loading a cart from the database, and pass to put()"""
+        with self.lock:
+            return self.generations.get(session_id, self.generation_floor)
+
+    def put(self, session_id, items, generation):
+        evicted = []
+        with self.lock:
+            if self.generations.get(session_id, self.generation_floor) != generation:
+                return  # Dropped since the load began, so the loaded lines may be stale
+            if session_id in self.carts:
+                return  # A concurrent load won; it may already hold pending changes
+            self.carts[session_id] = SessionCart(items)
+            for item in items:
+                self.item_sessions[item['id']] = session_id
+            overflow = len(self.carts) - CART_CACHE_MAX_SESSIONS
+            if overflow > 0:
+                evicted = list(self.carts)[:overflow]  # Least recently used
+        for victim in evicted:
+            if self.flush(victim):  # A cart whose writes failed stays cached until they succeed
+                self.drop(victim)
+
+    def session_of(self, item_id):
+        return self.item_sessions.get(item_id)
+
+    def set_quantity(self, item_id, quantity):
+        """Change a cached line's quantity and schedule the write; False if the line is not cached"""
+        with self.lock:
+            session_id = self.item_sessions.get(item_id)
+            cart = self.carts.get(session_id)
+            if cart is None:
+                return False
+            for item in cart.items:
+                if item['id'] == item_id:
+                    item['quantity'] = quantity
+            cart.pending[item_id] = quantity
+            self._schedule(session_id, cart, CART_FLUSH_DELAY)
+            return True
+
+    def _schedule(self, session_id, cart, delay):
+        if cart.timer is None:
+            cart.timer = threading.Timer(delay, self.flush, args=(session_id,))
+            cart.timer.daemon = True
+            cart.timer.start()
+
+    def flush(self, session_id):
+        """
+        Write a session's pending quantity changes now (waits for a flush already running)
+        Returns False if some writes failed; those changes stay pending and are retried
+        after CART_FLUSH_RETRY_DELAY.
+        """
+        with self.lock:
+            cart = self.carts.get(session_id)
+        if cart is None:
+            return True
+        with cart.flush_lock:
+            with self.lock:
+                pending, cart.pending = cart.pending, {}
+                if cart.timer is not None:
+                    cart.timer.cancel()
+                    cart.timer = None
+            failed = {}
+            for item_id, quantity in pending.items():
+                try:
+                    supabase.table('cart_items').update({'quantity': quantity}).eq('id', item_id).execute()
+                except Exception as e:
+                    print(f"Warning: Could not write cart quantity {quantity} for item {item_id} "
+                          f"of session {session_id}, will retry: {e}")
+                    failed[item_id] = quantity
+            if not failed:
+                return True
+            with self.lock:
+                if self.carts.get(session_id) is not cart:
+                    print(f"Warning: Cart of session {session_id} was reloaded; "
+                          f"unwritten quantities discarded: {failed}")
+                    return False
+                for item_id, quantity in failed.items():
+                    cart.pending.setdefault(item_id, quantity)  # A newer change made meanwhile wins
+                self._schedule(session_id, cart, CART_FLUSH_RETRY_DELAY)
+            return False
+
+    def flush_all(self):
+        with self.lock:
+            session_ids = list(self.carts)
+        for session_id in session_ids:
+            self.flush(session_id)
+
+    def drop(self, session_id):
+        """Forget a cached cart (after its lines were written directly to the database)"""
+        with self.lock:
+            self._remove(session_id)
+            self.sequence += 1
+            self.generations[session_id] = self.sequence
+            self.generations.move_to_end(session_id)
+            if len(self.generations) > CART_CACHE_MAX_SESSIONS:
+                # Oldest drop; raising the floor to it still invalidates that session's loads
+                _, self.generation_floor = self.generations.popitem(last=False)
+
+    def _remove(self, session_id):
+        cart = self.carts.pop(session_id, None)
+        if cart is not None:
+            if cart.timer is not None:
+                cart.timer.cancel()
+            for item in cart.items:
+                self.item_sessions.pop(item['id'], None)
+
+_cart_store = CartStore()
+atexit.register(_cart_store.flush_all)  # Don't lose changes still in their coalescing window
+
+def format_cart_item(item):
+    """Cart line as returned by get_cart, from a cart_items row with embedded product"""
+    product_info = item.get('products', {})
+    return {
+        'id': item['id'],
+        'product_id': item['product_id'],
+        'product_name': product_info.get('name') if product_info else None,
+        'size': item.get('size'),
+        'color': item.get('color'),
+        'quantity': item['quantity'],
+        'price': float(item['price']),
+        'image_url': product_info.get('image_url') if product_info else None,
+        'description': product_info.get('description') if product_info else None
+    }
+
+def load_cart(session_id):
+    """A session's cart lines, from the cart store or (on a miss) from the database"""
+    items = _cart_store.get(session_id)
+    if items is None:
+        generation = _cart_store.generation(session_id)
+        cart_response = supabase.table('cart_items')\
+            .select('*, products(name, image_url, description)')\
+            .eq('session_id', session_id)\
+            .order('created_at', desc=True)\
+            .execute()
+        items = [format_cart_item(item) for item in cart_response.data]
+        _cart_store.put(session_id, [dict(item) for item in items], generation)
+    return items
+
+def flush_cart(session_id):
+    """
+    Write a session's pending cart changes before reading or writing its lines in the database
+    Raises RuntimeError if they could not be written, rather than act on stale quantities
+    """
+    if not _cart_store.flush(session_id):
+        raise RuntimeError('Could not save pending cart changes, please try again')
+
+def cart_changed(session_id):
+    """Drop a session's cached cart after its lines were written directly to the database"""
+    _cart_store.drop(session_id)
+
+# ============================================
+# DISCOUNT ENGINE (checkout discount codes)
+# ============================================
+
+DISCOUNT_INDEX_TTL = int(os.getenv('DISCOUNT_INDEX_TTL', 300))  # seconds, catches out-of-band edits
+
+def normalize_discount_code(code):
+    return str(code or '').strip().upper()
+
+class DiscountIndex:
+    """
+    In-process index of discount codes (normalized code -> discounts row)
+    Rebuilt from the discounts table after every admin discount write, so validating
+    a code at checkout is a dictionary lookup instead of a table query.
+    """
+
+    def __init__(self, discounts):
+        self.loaded_at = time.time()
+        self.codes = {}
+        for discount in discounts:
+            code = normalize_discount_code(discount.get('code'))
+            if code and (code not in self.codes or discount.get('status') == 'active'):
+                self.codes[code] = discount  # An active row wins over a stale duplicate
+
+    def is_stale(self):
+        return time.time() - self.loaded_at > DISCOUNT_INDEX_TTL
+
+    def evaluate(self, code, subtotal):
+        """
+        Validate a code against an order subtotal
+        Returns: (discounts row, discount amount); raises ValueError with a customer-facing message
+        """
+        discount = self.codes.get(normalize_discount_code(code))
+        if discount is None or discount.get('status') != 'active':
+            raise ValueError('Invalid discount code')
+        
+        expiration_date = discount.get('expiration_date')
+        if expiration_date:
+            try:
+                expires = datetime.fromisoformat(str(expiration_date)[:10]).date()
+            except ValueError:
+                expires = None
+            if expires is not None and expires < datetime.now().date():
+                raise ValueError('This discount code has expired')
+        
+        usage_limit = discount.get('usage_limit')
+        if usage_limit is not None and (discount.get('usage_count') or 0) >= usage_limit:
+            raise ValueError('This discount code has reached its usage limit')
+        
+        min_order_value = float(discount.get('min_order_value') or 0)
+        if subtotal < min_order_value:
+            raise ValueError(f'This discount code requires a minimum order of {min_order_value:g}')
+        
+        value = float(discount.get('discount') or 0)
+        if (discount.get('type') or 'percentage') == 'percentage':
+            amount = subtotal * min(max(value, 0), 100) / 100
+        else:
+            amount = min(max(value, 0), subtotal)  # Fixed amount off
+        return discount, amount
+
+    def set_usage(self, discount_id, usage_count):
+        for discount in self.codes.values():
+            if discount.get('id') == discount_id:
+                discount['usage_count'] = usage_count
+
+_discount_index = None
+_discount_lock = threading.Lock()
+
+def load_discount_index():
+    return DiscountIndex(fetch_all_rows(lambda: supabase.table('discounts').select('*').order('id')))
+
+def get_discount_index():
+    """Current discount code index, (re)loaded on first use or after the TTL"""
+    global _discount_index
+    index = _discount_index
+    if index is not None and not index.is_stale():
+        return index
+    with _discount_lock:
+        if _discount_index is None or _discount_index.is_stale():
+            _discount_index = load_discount_index()
+        return _discount_index
+
+def discounts_changed():
+    """Rebuild the discount code index after an admin discount write"""
+    global _discount_index
+    with _discount_lock:
+        try:
+            _discount_index = load_discount_index()
+        except Exception as e:
+            print(f"Warning: Could not refresh discount index: {e}")
+            _discount_index = None  # Next checkout reloads
+
+def redeem_discount(discount):
+    """
+    Count one use of a validated discount (atomic in the database)
+    Raises ValueError if the code was used up (or deactivated) since it was validated
+    """
+    response = supabase.rpc('redeem_discount', {'p_discount_id': discount['id']}).execute()
+    if not response.data:
+        raise ValueError('This discount code is no longer available')
+    index = _discount_index
+    if index is not None:
+        index.set_usage(discount['id'], response.data[0]['usage_count'])
+
+def release_discount(discount):
+    """Give back a use counted by redeem_discount"""
+    response = supabase.rpc('release_discount', {'p_discount_id': discount['id']}).execute()
+    index = _discount_index
+    if index is not None and response.data:
+        index.set_usage(discount['id'], response.data[0]['usage_count'])
+
+# ============================================
+# RESPONSE CACHE (ETag / 304 for public GETs)
+# ============================================
+
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 300))  # seconds an entry is served without a rerun
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', 0))  # browser max-age; 0 = always revalidate
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2048))
+
+class ResponseCache:
+    """
+    LRU cache of rendered 200 responses keyed by route + normalized query string
+    Every entry carries invalidation tags (e.g. "product:<id>", "category:<name>",
+    "reviews:<id>"); write routes invalidate by tag instead of waiting for the TTL.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (body, mimetype, etag, tags, stored_at)
+        self.tag_keys = defaultdict(set)  # tag -> keys
+        self.generation = 0  # Bumped by every invalidation
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[4] > RESPONSE_CACHE_TTL:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype, etag, tags, generation):
+        """Store an entry unless an invalidation happened while it was being rendered"""
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (body, mimetype, etag, frozenset(tags), time.time())
+            for tag in tags:
+                self.tag_keys[tag].add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, *tags):
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.tag_keys.pop(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.tag_keys.clear()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[3]:
+                keys = self.tag_keys.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tag_keys[tag]
+
+_response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES)
+
+def add_cache_tags(*tags):
+    """Attach extra invalidation tags to the response being rendered (inside a cached view)"""
+    if 'cache_tags' in g:
+        g.cache_tags.update(tags)
+
+def invalidate_response_cache(*tags):
+    _response_cache.invalidate(*tags)
+
+def _conditional_response(body, mimetype, etag):
+    """200 with the body, or 304 when the client already holds this ETag"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, status=200, mimetype=mimetype)
+    response.set_etag(etag)
+    if RESPONSE_CACHE_MAX_AGE > 0:
+        response.headers['Cache-Control'] = f'public, max-age={RESPONSE_CACHE_MAX_AGE}'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def cached_response(*tag_templates):
+    """
+    Cache a public GET view's 200 responses with a strong ETag and 304 support
+    tag_templates: invalidation tags, formatted with the view's URL args (e.g. 'product:{product_id}');
+    views can add data-dependent tags with add_cache_tags()
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+            entry = _response_cache.get(key)
+            if entry is None:
+                generation = _response_cache.generation
+                g.cache_tags = {template.format(**kwargs) for template in tag_templates}
+                response = app.make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                _response_cache.put(key, body, response.mimetype, etag, g.cache_tags, generation)
+                return _conditional_response(body, response.mimetype, etag)
+            body, mimetype, etag = entry[0], entry[1], entry[2]
+            return _conditional_response(body, mimetype, etag)
+        return wrapper
+    return decorator
+
+def product_changed(product_id=None, neighbor_referrers=None):
+    """
+    Bring in-process read models and response caches up to date after a product write
+    Refreshes the catalog snapshot and the related products of the product and of the products
+    it is (or now becomes) related to, and invalidates its detail, its old and new category
+    listings, the unfiltered listings and the category list
+    neighbor_referrers: product_neighbor_referrers() read before a delete (None to read it now)
+    """
+    old_snapshot = _catalog_snapshot
+    refresh_catalog_snapshot()
+    new_snapshot = _catalog_snapshot
+    dependents = []
+    if product_id:
+        try:
+            dependents = product_neighbor_dependents(product_id, neighbor_referrers)
+            rebuild_product_neighbors(dependents)
+        except Exception as e:
+            print(f"Warning: Could not update related products: {e}")
+
+    tags = {'catalog', 'categories'}
+    if product_id:
+        tags.add(f'product:{product_id}')
+        tags.update(f'product:{dependent}' for dependent in dependents)  # Their pages embed related products
+        for snapshot in (old_snapshot, new_snapshot):
+            i = snapshot.position.get(product_id) if snapshot is not None else None
+            if i is not None:
+                tags.add(f'category:{snapshot.categories[snapshot.category_codes[i]]}')
+    else:
+        _response_cache.clear()
+        return
+    invalidate_response_cache(*tags)
+
+def reviews_changed(product_id):
+    """Invalidate caches that show a product's reviews or rating"""
+    tags = {f'reviews:{product_id}', 'catalog'}
+    snapshot = _catalog_snapshot
+    i = snapshot.position.get(product_id) if snapshot is not None else None
+    if i is not None:
+        tags.add(f'category:{snapshot.categories[snapshot.category_codes[i]]}')
+    invalidate_response_cache(*tags)
+
+# ============================================
+# SIZE CHART GRID CACHE
+# ============================================
+
+SIZE_CHART_CACHE_TTL = int(os.getenv('SIZE_CHART_CACHE_TTL', 3600))  # seconds, catches out-of-band edits
+
+_size_chart_grids = {}  # template id -> (grid, loaded_at)
+_size_chart_versions = defaultdict(int)  # template id -> bumped by every invalidation
+_size_chart_lock = threading.Lock()
+
+def get_size_chart_grid(template_id):
+    """
+    Assembled size chart grid for a template (see load_size_chart_grid), cached in-process
+    Admin size chart writes call size_chart_changed(), so cached grids are only
+    rebuilt after a change or the TTL. Callers must not mutate the returned grid.
+    """
+    key = str(template_id)
+    entry = _size_chart_grids.get(key)
+    if entry is not None and time.time() - entry[1] <= SIZE_CHART_CACHE_TTL:
+        return entry[0]
+    version = _size_chart_versions[key]
+    grid = load_size_chart_grid(template_id)
+    with _size_chart_lock:
+        if grid is not None and _size_chart_versions[key] == version:  # Not invalidated meanwhile
+            _size_chart_grids[key] = (grid, time.time())
+    return grid
+
+def size_chart_changed(template_id):
+    """Drop a template's cached grid and the responses that embed it"""
+    key = str(template_id)
+    with _size_chart_lock:
+        _size_chart_versions[key] += 1
+        _size_chart_grids.pop(key, None)
+    invalidate_response_cache(f'size-chart:{template_id}')
+
 # ============================================
 # FEATURE 1: PRODUCT DETAILS PAGE APIs
 # ============================================
 
 @app.route('/api/products/filter', methods=['GET'])
+@cached_response()
 def get_products_filtered():
     """
     Get products with filters and sorting (Category Page API)
@@ -44,180 +1715,45 @@ def get_products_filtered():
     - color (optional) - Filter by color
     - tag (optional) - Filter by tag (e.g., "Featured Product", "New Arrival")
     - page (optional, default: 1) - Page number
+    - cursor (optional) - Opaque cursor from pagination.next_cursor; takes precedence over page
     - limit (optional, default: 9) - Items per page
     - sort (optional) - Sort order: "price_high_low", "price_low_high", "newest", "oldest", "rating_high_low"
     """
     try:
         # Get query parameters
-        category = request.args.get('category')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        color = request.args.get('color')
-        tag = request.args.get('tag')  # Filter by tag
+        filters = parse_product_filters(request.args)
+        category = filters['category']
+        min_price = filters['min_price']
+        max_price = filters['max_price']
+        color = filters['color']
+        tag = filters['tag']  # Filter by tag
+        sort = filters['sort']  # Default to newest
         page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor')
         limit = request.args.get('limit', 9, type=int)
-        sort = request.args.get('sort', 'newest')  # Default to newest
         
-        # Calculate offset
-        offset = (page - 1) * limit
+        add_cache_tags(f'category:{category}' if category else 'catalog')
         
-        # Build query - only show active products for users
-        query = supabase.table('products').select('id, name, price, image_urls, color, category, tags', count='exact')
-        query = query.eq('status', 'active')  # Only show active products
-        
-        # Apply filters
-        if category:
-            query = query.eq('category', category)
-        if min_price is not None:
-            query = query.gte('price', min_price)
-        if max_price is not None:
-            query = query.lte('price', max_price)
-        # Color filter: check if color array contains the specified color
-        # For JSONB arrays, we'll filter in Python after fetching
-        color_filter_applied = color is not None
-        tag_filter_applied = tag is not None
-        
-        # Get total count (without color filter for now, will filter in Python)
-        count_query = supabase.table('products').select('id', count='exact')
-        count_query = count_query.eq('status', 'active')  # Only count active products
-        if category:
-            count_query = count_query.eq('category', category)
-        if min_price is not None:
-            count_query = count_query.gte('price', min_price)
-        if max_price is not None:
-            count_query = count_query.lte('price', max_price)
-        total_count = count_query.execute().count
-        
-        # Apply sorting
-        if sort == 'price_high_low':
-            query = query.order('price', desc=True)
-        elif sort == 'price_low_high':
-            query = query.order('price', desc=False)
-        elif sort == 'newest':
-            query = query.order('created_at', desc=True)
-        elif sort == 'oldest':
-            query = query.order('created_at', desc=False)
-        else:
-            # Default to newest
-            query = query.order('created_at', desc=True)
-        
-        # Get paginated products (fetch more if filters are applied to filter in Python)
-        fetch_limit = limit * 3 if (color_filter_applied or tag_filter_applied) else limit
-        response = query.range(offset, offset + fetch_limit).execute()
+        # Filter, sort and page the in-process catalog snapshot (active products only)
+        catalog = get_catalog_snapshot()
+        matches = catalog.filter(category=category, min_price=min_price, max_price=max_price,
+                                 color=color, tag=tag)
+        total_count = catalog.count(matches)
+        try:
+            page_positions, offset, next_cursor = page_catalog(catalog, matches, sort, page, limit, cursor)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        if cursor:
+            page = offset // limit + 1 if limit > 0 else 1
         
-        # Process products to include rating and format images
         products_list = []
-        for product in response.data:
-            # Apply color filter if specified
-            if color_filter_applied:
-                product_colors = product.get('color', [])
-                if isinstance(product_colors, list):
-                    # Check if any color in the array matches
-                    if color.lower() not in [c.lower() if isinstance(c, str) else str(c).lower() for c in product_colors]:
-                        continue
-                elif isinstance(product_colors, str):
-                    if product_colors.lower() != color.lower():
-                        continue
-                else:
-                    continue
-            
-            # Apply tag filter if specified
-            if tag_filter_applied:
-                product_tags = product.get('tags', [])
-                if isinstance(product_tags, list):
-                    # Check if any tag in the array matches
-                    if tag.lower() not in [t.lower() if isinstance(t, str) else str(t).lower() for t in product_tags]:
-                        continue
-                elif isinstance(product_tags, str):
-                    if product_tags.lower() != tag.lower():
-                        continue
-                else:
-                    continue
-            product_id = product['id']
-            
-            # Get average rating from reviews
-            reviews_response = supabase.table('reviews')\
-                .select('rating')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            ratings = [r['rating'] for r in reviews_response.data if r.get('rating')]
-            average_rating = round(sum(ratings) / len(ratings), 2) if ratings else 0.0
-            
-            # Get first 2 images
-            image_urls = product.get('image_urls', [])
-            if isinstance(image_urls, list):
-                images = image_urls[:2]  # First 2 images
-            else:
-                # Fallback to single image_url if image_urls is not available
-                single_image = product.get('image_url')
-                images = [single_image] if single_image else []
-                images = images[:2]
-            
-            # Get color array (handle both JSONB array and string)
-            color_data = product.get('color', [])
-            if isinstance(color_data, str):
-                color_list = [color_data] if color_data else []
-            elif isinstance(color_data, list):
-                color_list = color_data
-            else:
-                color_list = []
-            
-            products_list.append({
-                'id': product_id,
-                'name': product['name'],
-                'rating': average_rating,
-                'image': images,  # Array of max 2 images
-                'price': float(product['price']),
-                'color': color_list  # Array of colors
-            })
-            
-            # Stop if we have enough items
-            if len(products_list) >= limit:
-                break
-        
-        # Apply sorting after filtering (for rating-based sorting)
-        if sort == 'rating_high_low':
-            # Need to sort by rating after fetching
-            products_with_ratings = []
-            for p in products_list:
-                products_with_ratings.append((p['rating'], p))
-            products_with_ratings.sort(key=lambda x: x[0], reverse=True)
-            products_list = [p[1] for p in products_with_ratings]
-        
-        # For color/tag filters, we need to recalculate total count
-        if color_filter_applied or tag_filter_applied:
-            all_products = supabase.table('products').select('id, color, tags').execute()
-            filtered_count = 0
-            for p in all_products.data:
-                # Check color filter
-                if color_filter_applied:
-                    p_colors = p.get('color', [])
-                    color_match = False
-                    if isinstance(p_colors, list):
-                        if color.lower() in [c.lower() if isinstance(c, str) else str(c).lower() for c in p_colors]:
-                            color_match = True
-                    elif isinstance(p_colors, str) and p_colors.lower() == color.lower():
-                        color_match = True
-                    if not color_match:
-                        continue
-                
-                # Check tag filter
-                if tag_filter_applied:
-                    p_tags = p.get('tags', [])
-                    tag_match = False
-                    if isinstance(p_tags, list):
-                        if tag.lower() in [t.lower() if isinstance(t, str) else str(t).lower() for t in p_tags]:
-                            tag_match = True
-                    elif isinstance(p_tags, str) and p_tags.lower() == tag.lower():
-                        tag_match = True
-                    if not tag_match:
-                        continue
-                
-                filtered_count += 1
-            total_count = filtered_count
-        else:
-            total_count = count_query.execute().count
+        for i in page_positions:
+            product_data = catalog.card(i, ndigits=2)
+            product_data['color'] = catalog.colors[i]  # Array of colors
+            products_list.append(product_data)
         
         # Calculate total pages
         total_pages = (total_count + limit - 1) // limit if total_count > 0 else 0
@@ -232,6 +1768,7 @@ def get_products_filtered():
                 "total_pages": total_pages,
                 "has_next": page < total_pages,
                 "has_prev": page > 1,
+                "next_cursor": next_cursor,
                 "showing": f"{offset + 1:02d}-{min(offset + len(products_list), total_count):02d} of {total_count} Products"
             },
             "filters_applied": {
@@ -251,7 +1788,57 @@ def get_products_filtered():
             "error": str(e)
         }), 500
 
+@app.route('/api/products/facets', methods=['GET'])
+@cached_response()
+def get_product_facets():
+    """
+    Facet counts for the product filter sidebar
+    Query params: same filters as /api/products/filter (category, min_price, max_price, color, tag), plus
+    - price_buckets (optional) - Comma-separated ascending lower bucket edges (e.g., "0,500,1000")
+    Returns: total, and counts per category, color, tag and price bucket. Each facet is
+    counted with every other active filter applied, but not its own.
+    """
+    try:
+        filters = parse_product_filters(request.args)
+        price_edges = FACET_PRICE_EDGES
+        if request.args.get('price_buckets'):
+            try:
+                price_edges = tuple(float(edge) for edge in request.args['price_buckets'].split(','))
+            except ValueError:
+                price_edges = ()
+            if not price_edges or list(price_edges) != sorted(set(price_edges)):
+                return jsonify({
+                    "success": False,
+                    "message": "price_buckets must be ascending comma-separated numbers"
+                }), 400
+        
+        add_cache_tags(f"category:{filters['category']}" if filters['category'] else 'catalog')
+        
+        catalog = get_catalog_snapshot()
+        facets = catalog.facets(category=filters['category'], min_price=filters['min_price'],
+                                max_price=filters['max_price'], color=filters['color'],
+                                tag=filters['tag'], price_edges=price_edges)
+        
+        return jsonify({
+            "success": True,
+            "data": facets,
+            "filters_applied": {
+                "category": filters['category'],
+                "min_price": filters['min_price'],
+                "max_price": filters['max_price'],
+                "color": filters['color'],
+                "tag": filters['tag']
+            }
+        }), 200
+            
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @app.route('/api/products/<product_id>', methods=['GET'])
+@cached_response('product:{product_id}')
 def get_product(product_id):
     """
     Get product details by ID
@@ -261,56 +1848,15 @@ def get_product(product_id):
         response = supabase.table('products').select('*').eq('id', product_id).eq('status', 'active').execute()
         
         if response.data and len(response.data) > 0:
-            product_data = response.data[0]
+            product_data = without_generated_columns(response.data[0])
             
             # Fetch product size stock if product has size_chart_template_id
             if product_data.get('size_chart_template_id'):
+                add_cache_tags(f"size-chart:{product_data['size_chart_template_id']}")  # Size labels come from its rows
                 try:
-                    # Get product_sizes with stock - use a simpler query
-                    product_sizes_response = supabase.table('product_sizes')\
-                        .select('id, size_chart_row_id')\
-                        .eq('product_id', product_id)\
-                        .execute()
-                    
-                    # Format size stock data
-                    size_stocks = []
-                    if product_sizes_response.data:
-                        for ps in product_sizes_response.data:
-                            product_size_id = ps['id']
-                            row_id = ps['size_chart_row_id']
-                            
-                            # Get size label from size_chart_rows
-                            row_response = supabase.table('size_chart_rows')\
-                                .select('size_label')\
-                                .eq('id', row_id)\
-                                .execute()
-                            
-                            size_label = ''
-                            if row_response.data and len(row_response.data) > 0:
-                                size_label = row_response.data[0].get('size_label', '')
-                            
-                            # Get stock from product_size_stock
-                            stock_response = supabase.table('product_size_stock')\
-                                .select('stock_quantity')\
-                                .eq('product_size_id', product_size_id)\
-                                .execute()
-                            
-                            stock_value = 0
-                            if stock_response.data and len(stock_response.data) > 0:
-                                stock_value = stock_response.data[0].get('stock_quantity', 0)
-                            
-                            if size_label:  # Only add if we have a valid size label
-                                size_stocks.append({
-                                    'row_id': row_id,
-                                    'size_label': size_label,
-                                    'stock': stock_value
-                                })
-                    
-                    product_data['size_stocks'] = size_stocks
+                    product_data['size_stocks'] = load_size_stocks([product_id])[product_id]
                 except Exception as e:
                     print(f"Warning: Could not fetch size stocks: {e}")
-                    import traceback
-                    traceback.print_exc()
                     product_data['size_stocks'] = []
             else:
                 product_data['size_stocks'] = []
@@ -331,7 +1877,56 @@ def get_product(product_id):
             "error": str(e)
         }), 500
 
+def load_size_chart_grid(template_id):
+    """
+    Size chart template with its rows, columns and values grid (row label -> column key -> value)
+    Returns: {template, template_name, rows, columns, values_grid}, or None if the template does not exist
+    """
+    template_response, rows_response, columns_response = run_concurrently(
+        lambda: supabase.table('size_chart_templates').select('*').eq('id', template_id).execute(),
+        lambda: supabase.table('size_chart_rows').select('*').eq('template_id', template_id).order('sort_order').execute(),
+        lambda: supabase.table('size_chart_columns').select('*').eq('template_id', template_id).order('sort_order').execute()
+    )
+    if not template_response.data:
+        return None
+    
+    rows = rows_response.data or []
+    columns = columns_response.data or []
+    row_ids = [r['id'] for r in rows]
+    
+    values_grid = {}
+    if row_ids:
+        values_response = supabase.table('size_chart_values').select('*').in_('row_id', row_ids).execute()
+        row_map = {r['id']: r['size_label'] for r in rows}
+        col_map = {c['id']: c['column_key'] for c in columns}
+        for val in (values_response.data or []):
+            row_label = row_map.get(val['row_id'])
+            col_key = col_map.get(val['column_id'])
+            if row_label and col_key:
+                if row_label not in values_grid:
+                    values_grid[row_label] = {}
+                values_grid[row_label][col_key] = val['value']
+    
+    return {
+        'template': template_response.data[0],
+        'template_name': template_response.data[0].get('name', ''),
+        'rows': rows,
+        'columns': columns,
+        'values_grid': values_grid
+    }
+
+def size_chart_payload(grid, sizes):
+    """Public size chart response: the template grid plus per-size stock (size label -> stock)"""
+    return {
+        'template_name': grid['template_name'],
+        'rows': grid['rows'],
+        'columns': grid['columns'],
+        'values_grid': grid['values_grid'],
+        'size_stocks': {size['size_label']: size['stock'] for size in sizes}
+    }
+
 @app.route('/api/products/<product_id>/size-chart', methods=['GET'])
+@cached_response('product:{product_id}')
 def get_product_size_chart(product_id):
     """
     Get size chart for a product (public endpoint)
@@ -353,73 +1948,21 @@ def get_product_size_chart(product_id):
                 "success": False,
                 "message": "Product does not have a size chart"
             }), 404
+        add_cache_tags(f'size-chart:{template_id}')
         
-        # Get template details
-        template_response = supabase.table('size_chart_templates').select('*').eq('id', template_id).execute()
-        if not template_response.data:
+        # Template grid and this product's stock in parallel; the grid goes first so a
+        # cache miss runs on this thread and can still load the template in parallel
+        grid, sizes = run_concurrently(
+            lambda: get_size_chart_grid(template_id),
+            lambda: load_size_stocks([product_id])[product_id]
+        )
+        if grid is None:
             return jsonify({
                 "success": False,
                 "message": "Size chart template not found"
             }), 404
         
-        template = template_response.data[0]
-        rows_response = supabase.table('size_chart_rows').select('*').eq('template_id', template_id).order('sort_order').execute()
-        columns_response = supabase.table('size_chart_columns').select('*').eq('template_id', template_id).order('sort_order').execute()
-        
-        rows = rows_response.data or []
-        columns = columns_response.data or []
-        row_ids = [r['id'] for r in rows]
-        
-        # Get size chart values
-        values_grid = {}
-        if row_ids:
-            values_response = supabase.table('size_chart_values').select('*').in_('row_id', row_ids).execute()
-            row_map = {r['id']: r['size_label'] for r in rows}
-            col_map = {c['id']: c['column_key'] for c in columns}
-            for val in (values_response.data or []):
-                row_label = row_map.get(val['row_id'])
-                col_key = col_map.get(val['column_id'])
-                if row_label and col_key:
-                    if row_label not in values_grid:
-                        values_grid[row_label] = {}
-                    values_grid[row_label][col_key] = val['value']
-        
-        # Get stock for each size
-        size_stocks = {}
-        if row_ids:
-            product_sizes = supabase.table('product_sizes')\
-                .select('size_chart_row_id, size_chart_rows(size_label), product_size_stock(stock_quantity)')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            if product_sizes.data:
-                for ps in product_sizes.data:
-                    row = ps.get('size_chart_rows')
-                    stock_data = ps.get('product_size_stock')
-                    
-                    if isinstance(row, list) and len(row) > 0:
-                        row = row[0]
-                    elif not isinstance(row, dict):
-                        continue
-                    
-                    if row:
-                        size_label = row.get('size_label', '')
-                        stock_value = 0
-                        if stock_data:
-                            if isinstance(stock_data, list) and len(stock_data) > 0:
-                                stock_value = stock_data[0].get('stock_quantity', 0)
-                            elif isinstance(stock_data, dict):
-                                stock_value = stock_data.get('stock_quantity', 0)
-                        size_stocks[size_label] = stock_value
-        
-        # Format response
-        result = {
-            'template_name': template.get('name', ''),
-            'rows': rows,
-            'columns': columns,
-            'values_grid': values_grid,
-            'size_stocks': size_stocks
-        }
+        result = size_chart_payload(grid, sizes)
         
         return jsonify({
             "success": True,
@@ -433,24 +1976,93 @@ def get_product_size_chart(product_id):
         }), 500
 
 
+REVIEWS_PAGE_SIZE = 10
+REVIEWS_MAX_PAGE_SIZE = 100
+
+def load_reviews_page(product_id, limit=REVIEWS_PAGE_SIZE, cursor=None, rating=None):
+    """
+    One page of a product's reviews, newest first, by keyset on (posted_date, created_at, id)
+    cursor: next_cursor of the previous page; rating: only reviews with this rating
+    Returns: (reviews, next_cursor); raises ValueError for a bad cursor
+    """
+    params = {'p_product_id': product_id, 'p_limit': limit + 1, 'p_rating': rating}
+    if cursor:
+        state = decode_cursor(cursor)
+        if state.get('rating') != rating or not state.get('id'):
+            raise ValueError('Cursor does not match this review filter')
+        params.update({
+            'p_after_posted_date': state.get('posted_date'),
+            'p_after_created_at': state.get('created_at'),
+            'p_after_id': state['id']
+        })
+    
+    # One extra row tells whether another page follows
+    reviews = supabase.rpc('product_reviews_page', params).execute().data or []
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        last = reviews[-1]
+        next_cursor = encode_cursor({
+            'rating': rating,
+            'posted_date': last.get('posted_date'),
+            'created_at': last.get('created_at'),
+            'id': last['id']
+        })
+    return reviews, next_cursor
+
+def review_summary(product_id):
+    """Rating summary for the reviews endpoints: average (1 decimal), count, 1-5 star histogram"""
+    summary = get_rating_summaries([product_id])[product_id]
+    return {
+        "average": round(summary['average'], 1),
+        "count": summary['count'],
+        "histogram": summary['histogram']
+    }
+
 @app.route('/api/products/<product_id>/reviews', methods=['GET'])
+@cached_response('reviews:{product_id}')
 def get_product_reviews(product_id):
     """
-    Get all reviews for a product
-    Returns: List of reviews with user names, ratings, comments, and dates
+    Get a page of reviews for a product, newest first
+    Query params:
+    - limit (optional, default: 10, max: 100) - Reviews per page
+    - cursor (optional) - Opaque cursor from next_cursor, to load the following page
+    - rating (optional) - Only reviews with this rating (1-5)
+    Returns: List of reviews with user names, ratings, comments, and dates, total matching
+             reviews, next_cursor (null on the last page), plus a rating summary
+             (average, count, 1-5 star histogram)
     """
     try:
-        response = supabase.table('reviews')\
-            .select('*')\
-            .eq('product_id', product_id)\
-            .order('posted_date', desc=True)\
-            .order('created_at', desc=True)\
-            .execute()
+        limit = min(max(request.args.get('limit', REVIEWS_PAGE_SIZE, type=int), 1), REVIEWS_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        rating = request.args.get('rating', type=int)
+        if rating is not None and not 1 <= rating <= 5:
+            return jsonify({
+                "success": False,
+                "message": "Rating must be between 1 and 5"
+            }), 400
+        
+        try:
+            (reviews, next_cursor), summary = run_concurrently(
+                lambda: load_reviews_page(product_id, limit, cursor, rating),
+                lambda: review_summary(product_id)
+            )
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        
+        # Totals come from the rating summary, no count query over the reviews
+        total = summary['histogram'][str(rating)] if rating is not None else summary['count']
         
         return jsonify({
             "success": True,
-            "data": response.data,
-            "count": len(response.data)
+            "data": reviews,
+            "count": len(reviews),
+            "total": total,
+            "next_cursor": next_cursor,
+            "summary": summary
         }), 200
             
     except Exception as e:
@@ -477,10 +2089,11 @@ def add_product_review(product_id):
                 "message": "user_name and rating are required"
             }), 400
         
-        if rating < 1 or rating > 5:
+        # Fractional ratings would be truncated in the summary and drift from the reviews table
+        if isinstance(rating, bool) or not isinstance(rating, int) or rating < 1 or rating > 5:
             return jsonify({
                 "success": False,
-                "message": "Rating must be between 1 and 5"
+                "message": "Rating must be an integer between 1 and 5"
             }), 400
         
         review_data = {
@@ -493,6 +2106,14 @@ def add_product_review(product_id):
         
         response = supabase.table('reviews').insert(review_data).execute()
         
+        # Keep the per-product rating summary in step with the new review
+        try:
+            record_product_rating(product_id, rating)
+            refresh_catalog_rating(product_id)
+        except Exception as e:
+            print(f"Warning: Could not update rating summary: {e}")
+        reviews_changed(product_id)
+        
         return jsonify({
             "success": True,
             "message": "Review added successfully",
@@ -505,62 +2126,47 @@ def add_product_review(product_id):
             "error": str(e)
         }), 500
 
+def load_related_products(product_id, limit=4):
+    """
+    Listing cards for products related to a product, most similar first
+    Reads the precomputed neighbor list (see rebuild_product_neighbors); falls back to the
+    newest active products of the same category, or of the whole catalog if it has no category
+    """
+    catalog = get_catalog_snapshot()
+    response = supabase.table('product_neighbors')\
+        .select('neighbor_id')\
+        .eq('product_id', product_id)\
+        .order('rank')\
+        .limit(RELATED_TOP_K)\
+        .execute()
+    
+    active = catalog.status_index.get('active', 0)
+    chosen = []
+    for row in (response.data or []):
+        j = catalog.position.get(row['neighbor_id'])
+        if j is not None and active >> j & 1 and len(chosen) < limit:
+            chosen.append(j)
+    
+    if len(chosen) < limit:
+        i = catalog.position.get(product_id)
+        category = catalog.categories[catalog.category_codes[i]] if i is not None else None
+        bits = catalog.filter(category=category) if category else catalog.filter()
+        for j in catalog.ordered(bits, 'newest', limit=limit + len(chosen) + 1):
+            if j != i and j not in chosen and len(chosen) < limit:
+                chosen.append(j)
+    
+    return [catalog.card(j) for j in chosen]
+
 @app.route('/api/products/<product_id>/related', methods=['GET'])
 def get_related_products(product_id):
     """
-    Get related products (same category, excluding current product)
+    Get related products (most similar by category, tags, colors and price)
     Query params: limit (default: 4)
     """
     try:
         limit = request.args.get('limit', 4, type=int)
         
-        # First get the current product's category
-        product_response = supabase.table('products').select('category').eq('id', product_id).execute()
-        
-        if product_response.data and product_response.data[0].get('category'):
-            category = product_response.data[0]['category']
-            response = supabase.table('products')\
-                .select('id, name, description, price, original_price, image_url, image_urls, category')\
-                .eq('category', category)\
-                .eq('status', 'active')\
-                .neq('id', product_id)\
-                .limit(limit)\
-                .execute()
-        else:
-            # If no category, return random products
-            response = supabase.table('products')\
-                .select('id, name, description, price, original_price, image_url, image_urls, category')\
-                .neq('id', product_id)\
-                .limit(limit)\
-                .execute()
-        
-        # Format products for frontend
-        formatted_products = []
-        for product in response.data:
-            # Get average rating
-            reviews_response = supabase.table('reviews')\
-                .select('rating')\
-                .eq('product_id', product['id'])\
-                .execute()
-            
-            ratings = [r['rating'] for r in reviews_response.data if r.get('rating')]
-            average_rating = round(sum(ratings) / len(ratings), 1) if ratings else 0.0
-            
-            # Format images
-            image_urls = product.get('image_urls', [])
-            if isinstance(image_urls, list):
-                images = image_urls[:2] if len(image_urls) > 0 else []
-            else:
-                single_image = product.get('image_url')
-                images = [single_image] if single_image else []
-            
-            formatted_products.append({
-                'id': product.get('id'),
-                'name': product.get('name', ''),
-                'price': float(product.get('price', 0)),
-                'rating': average_rating,
-                'image': images
-            })
+        formatted_products = load_related_products(product_id, limit)
         
         return jsonify({
             "success": True,
@@ -574,6 +2180,64 @@ def get_related_products(product_id):
             "error": str(e)
         }), 500
 
+@app.route('/api/products/<product_id>/page', methods=['GET'])
+@cached_response('product:{product_id}', 'reviews:{product_id}')
+def get_product_page(product_id):
+    """
+    Everything the product page needs in one request
+    Query params: reviews_limit (default: 5), related_limit (default: 4)
+    Returns: product (with size_stocks), size_chart (null if none), reviews (first page),
+             reviews_next_cursor (for /api/products/<id>/reviews), review_summary, related
+    """
+    try:
+        reviews_limit = min(max(request.args.get('reviews_limit', 5, type=int), 1), REVIEWS_MAX_PAGE_SIZE)
+        related_limit = request.args.get('related_limit', 4, type=int)
+        
+        # The product row resolves the template and category every other part needs
+        response = supabase.table('products').select('*').eq('id', product_id).eq('status', 'active').execute()
+        if not response.data:
+            return jsonify({
+                "success": False,
+                "message": "Product not found"
+            }), 404
+        
+        product_data = without_generated_columns(response.data[0])
+        template_id = product_data.get('size_chart_template_id')
+        category = product_data.get('category')
+        add_cache_tags(f'category:{category}' if category else 'catalog')
+        if template_id:
+            add_cache_tags(f'size-chart:{template_id}')
+        
+        # The grid goes first (runs on this thread), so a cache miss still loads in parallel
+        grid, sizes, (reviews, reviews_cursor), summary, related = run_concurrently(
+            lambda: get_size_chart_grid(template_id) if template_id else None,
+            lambda: load_size_stocks([product_id])[product_id] if template_id else [],
+            lambda: load_reviews_page(product_id, reviews_limit),
+            lambda: review_summary(product_id),
+            lambda: load_related_products(product_id, related_limit)
+        )
+        
+        product_data['size_stocks'] = sizes
+        size_chart = size_chart_payload(grid, sizes) if grid is not None else None
+        
+        return jsonify({
+            "success": True,
+            "data": {
+                "product": product_data,
+                "size_chart": size_chart,
+                "reviews": reviews,
+                "reviews_next_cursor": reviews_cursor,
+                "review_summary": summary,
+                "related": related
+            }
+        }), 200
+            
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 # ============================================
 # FEATURE 2: CHECKOUT PAGE APIs
 # ============================================
@@ -593,27 +2257,8 @@ def get_cart():
                 "message": "session_id is required"
             }), 400
         
-        # Get cart items with product details
-        cart_response = supabase.table('cart_items')\
-            .select('*, products(name, image_url, description)')\
-            .eq('session_id', session_id)\
-            .order('created_at', desc=True)\
-            .execute()
-        
-        items = []
-        for item in cart_response.data:
-            product_info = item.get('products', {})
-            items.append({
-                'id': item['id'],
-                'product_id': item['product_id'],
-                'product_name': product_info.get('name') if product_info else None,
-                'size': item.get('size'),
-                'color': item.get('color'),
-                'quantity': item['quantity'],
-                'price': float(item['price']),
-                'image_url': product_info.get('image_url') if product_info else None,
-                'description': product_info.get('description') if product_info else None
-            })
+        # Served from the write-behind cart store when cached
+        items = load_cart(session_id)
         
         # Calculate subtotal
         subtotal = sum(float(item['price']) * item['quantity'] for item in items)
@@ -633,6 +2278,23 @@ def get_cart():
             "error": str(e)
         }), 500
 
+CART_BATCH_MAX_ITEMS = 50
+
+def add_cart_items(session_id, items):
+    """
+    Add items ({product_id, size, color, quantity}) to a session's cart in one atomic upsert
+    Lines are unique per (session_id, product_id, size, color); adding an existing line
+    increments its quantity. Unknown products are skipped.
+    Returns: resulting cart lines [{id, product_id, size, color, quantity}]
+    """
+    flush_cart(session_id)  # Pending absolute quantities must not overwrite the increments
+    response = supabase.rpc('add_cart_items', {
+        'p_session_id': session_id,
+        'p_items': items
+    }).execute()
+    cart_changed(session_id)
+    return response.data or []
+
 @app.route('/api/cart', methods=['POST'])
 def add_to_cart():
     """
@@ -653,47 +2315,27 @@ def add_to_cart():
                 "message": "session_id and product_id are required"
             }), 400
         
-        # Get product price
-        product_response = supabase.table('products').select('price').eq('id', product_id).execute()
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            return jsonify({
+                "success": False,
+                "message": "quantity must be a positive integer"
+            }), 400
+        
+        # Insert the line, or add to its quantity if it is already in the cart
+        lines = add_cart_items(session_id, [{
+            'product_id': product_id,
+            'size': size,
+            'color': color,
+            'quantity': quantity
+        }])
         
-        if not product_response.data:
+        if not lines:
             return jsonify({
                 "success": False,
                 "message": "Product not found"
             }), 404
         
-        price = product_response.data[0]['price']
-        
-        # Check if item already exists in cart
-        existing_response = supabase.table('cart_items')\
-            .select('id, quantity')\
-            .eq('session_id', session_id)\
-            .eq('product_id', product_id)\
-            .eq('size', size)\
-            .eq('color', color)\
-            .execute()
-        
-        if existing_response.data:
-            # Update quantity
-            existing_item = existing_response.data[0]
-            new_quantity = existing_item['quantity'] + quantity
-            supabase.table('cart_items')\
-                .update({'quantity': new_quantity})\
-                .eq('id', existing_item['id'])\
-                .execute()
-            cart_item_id = existing_item['id']
-        else:
-            # Insert new item
-            cart_data = {
-                'session_id': session_id,
-                'product_id': product_id,
-                'size': size,
-                'color': color,
-                'quantity': quantity,
-                'price': price
-            }
-            response = supabase.table('cart_items').insert(cart_data).execute()
-            cart_item_id = response.data[0]['id'] if response.data else None
+        cart_item_id = lines[0]['id']
         
         return jsonify({
             "success": True,
@@ -707,6 +2349,63 @@ def add_to_cart():
             "error": str(e)
         }), 500
 
+@app.route('/api/cart/batch', methods=['POST'])
+def add_to_cart_batch():
+    """
+    Add several items to cart at once (e.g. "add outfit", reorder)
+    Body: { "session_id": "xxx", "items": [{ "product_id": "xxx", "size": "L", "color": "Red", "quantity": 1 }, ...] }
+    Returns: The resulting cart lines, and the product_ids that were not found
+    """
+    try:
+        data = request.json
+        session_id = data.get('session_id')
+        items = data.get('items')
+        
+        if not session_id or not isinstance(items, list) or not items:
+            return jsonify({
+                "success": False,
+                "message": "session_id and a non-empty items list are required"
+            }), 400
+        
+        if len(items) > CART_BATCH_MAX_ITEMS:
+            return jsonify({
+                "success": False,
+                "message": f"At most {CART_BATCH_MAX_ITEMS} items can be added at once"
+            }), 400
+        
+        cart_items = []
+        for item in items:
+            quantity = item.get('quantity', 1) if isinstance(item, dict) else None
+            if not isinstance(item, dict) or not item.get('product_id') \
+                    or isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+                return jsonify({
+                    "success": False,
+                    "message": "Each item needs a product_id and a positive integer quantity"
+                }), 400
+            cart_items.append({
+                'product_id': item['product_id'],
+                'size': item.get('size'),
+                'color': item.get('color'),
+                'quantity': quantity
+            })
+        
+        lines = add_cart_items(session_id, cart_items)
+        found = {line['product_id'] for line in lines}
+        missing = sorted({item['product_id'] for item in cart_items} - found)
+        
+        return jsonify({
+            "success": True,
+            "message": f"{len(lines)} cart lines updated",
+            "data": lines,
+            "missing_product_ids": missing
+        }), 201
+            
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @app.route('/api/cart/<cart_item_id>', methods=['PUT'])
 def update_cart_item(cart_item_id):
     """
@@ -717,22 +2416,25 @@ def update_cart_item(cart_item_id):
         data = request.json
         quantity = data.get('quantity')
         
-        if not quantity or quantity < 1:
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
             return jsonify({
                 "success": False,
-                "message": "Valid quantity is required"
+                "message": "quantity must be a positive integer"
             }), 400
         
-        response = supabase.table('cart_items')\
-            .update({'quantity': quantity})\
-            .eq('id', cart_item_id)\
-            .execute()
-        
-        if not response.data:
-            return jsonify({
-                "success": False,
-                "message": "Cart item not found"
-            }), 404
+        # Cached carts take the change in memory; the write follows within CART_FLUSH_DELAY
+        if not _cart_store.set_quantity(cart_item_id, quantity):
+            response = supabase.table('cart_items')\
+                .update({'quantity': quantity})\
+                .eq('id', cart_item_id)\
+                .execute()
+            
+            if not response.data:
+                return jsonify({
+                    "success": False,
+                    "message": "Cart item not found"
+                }), 404
+            cart_changed(response.data[0].get('session_id'))
         
         return jsonify({
             "success": True,
@@ -751,6 +2453,9 @@ def remove_from_cart(cart_item_id):
     Remove item from cart
     """
     try:
+        session_id = _cart_store.session_of(cart_item_id)
+        if session_id:
+            flush_cart(session_id)
         response = supabase.table('cart_items').delete().eq('id', cart_item_id).execute()
         
         if not response.data:
@@ -758,6 +2463,7 @@ def remove_from_cart(cart_item_id):
                 "success": False,
                 "message": "Cart item not found"
             }), 404
+        cart_changed(session_id or response.data[0].get('session_id'))
         
         return jsonify({
             "success": True,
@@ -784,15 +2490,17 @@ def create_order():
             "thana": "Gulshan",
             "full_address": "123 Main St"
         },
-        "discount_percentage": 20,
+        "discount_code": "SAVE20",
         "delivery_fee": 15
     }
+    The discount is computed from discount_code on the server; a client-sent
+    discount_percentage is ignored.
     """
     try:
         data = request.json
         session_id = data.get('session_id')
         customer_data = data.get('customer', {})
-        discount_percentage = data.get('discount_percentage', 0)
+        discount_code = (data.get('discount_code') or '').strip()
         delivery_fee = data.get('delivery_fee', 15)
         
         if not session_id:
@@ -801,98 +2509,207 @@ def create_order():
                 "message": "session_id is required"
             }), 400
         
-        # Get cart items with product names and images
-        cart_response = supabase.table('cart_items')\
-            .select('*, products(name, image_url, image_urls)')\
-            .eq('session_id', session_id)\
-            .execute()
+        # Pending quantity changes must reach the database before the cart is read
+        flush_cart(session_id)
+        
+        # Get cart items (with product names and images) and create the customer in parallel
+        cart_response, customer_response = run_concurrently(
+            lambda: supabase.table('cart_items')
+                .select('*, products(name, image_url, image_urls)')
+                .eq('session_id', session_id)
+                .execute(),
+            lambda: supabase.table('customers').insert({
+                'full_name': customer_data.get('full_name'),
+                'email': customer_data.get('email'),
+                'phone_number': customer_data.get('phone_number'),
+                'district': customer_data.get('district'),
+                'thana': customer_data.get('thana'),
+                'full_address': customer_data.get('full_address')
+            }).execute(),
+            return_exceptions=True
+        )
         
-        if not cart_response.data:
+        # The customer is only kept when an order can be placed for them
+        if isinstance(cart_response, Exception) or not cart_response.data:
+            if not isinstance(customer_response, Exception) and customer_response.data:
+                supabase.table('customers').delete().eq('id', customer_response.data[0]['id']).execute()
+            if isinstance(cart_response, Exception):
+                raise cart_response
             return jsonify({
                 "success": False,
                 "message": "Cart is empty"
             }), 400
+        if isinstance(customer_response, Exception):
+            raise customer_response
+        
+        customer_id = customer_response.data[0]['id']
         
         # Calculate subtotal
         subtotal = sum(float(item['price']) * item['quantity'] for item in cart_response.data)
-        discount = subtotal * (discount_percentage / 100)
-        total = subtotal - discount + delivery_fee
-        
-        # Create customer
-        customer_response = supabase.table('customers').insert({
-            'full_name': customer_data.get('full_name'),
-            'email': customer_data.get('email'),
-            'phone_number': customer_data.get('phone_number'),
-            'district': customer_data.get('district'),
-            'thana': customer_data.get('thana'),
-            'full_address': customer_data.get('full_address')
-        }).execute()
         
-        customer_id = customer_response.data[0]['id']
+        # From here on every failure undoes what was written: the order, the discount use
+        # and the customer, so an abandoned checkout leaves nothing behind
+        discount = 0
+        applied_discount = None
+        order_id = None
+        
+        def abandon_order():
+            undo = []
+            if order_id is not None:
+                undo.append(lambda: supabase.table('orders').delete().eq('id', order_id).execute())
+            if applied_discount is not None:
+                undo.append(lambda: release_discount(applied_discount))
+            undo.append(lambda: supabase.table('customers').delete().eq('id', customer_id).execute())
+            for step in undo:
+                try:
+                    step()
+                except Exception as e:
+                    print(f"Warning: Could not roll back failed order for customer {customer_id}: {e}")
         
-        # Get user_id from request if available (for authenticated users)
-        user_id = data.get('user_id')
-        
-        # Create order
-        order_data = {
-            'customer_id': customer_id,
-            'session_id': session_id,
-            'subtotal': subtotal,
-            'discount': discount,
-            'delivery_fee': delivery_fee,
-            'total': total,
-            'status': 'pending'
-        }
-        if user_id:
-            order_data['user_id'] = user_id
+        try:
+            # Validate the discount code in memory, then count its use atomically
+            if discount_code:
+                try:
+                    matched_discount, discount = get_discount_index().evaluate(discount_code, subtotal)
+                    redeem_discount(matched_discount)
+                    applied_discount = matched_discount
+                except ValueError as e:
+                    abandon_order()
+                    return jsonify({
+                        "success": False,
+                        "message": str(e)
+                    }), 400
+            total = subtotal - discount + delivery_fee
+            
+            # Get user_id from request if available (for authenticated users)
+            user_id = data.get('user_id')
+            
+            # Create order
+            order_data = {
+                'customer_id': customer_id,
+                'session_id': session_id,
+                'subtotal': subtotal,
+                'discount': discount,
+                'delivery_fee': delivery_fee,
+                'total': total,
+                'status': 'pending'
+            }
+            if user_id:
+                order_data['user_id'] = user_id
+            
+            order_response = supabase.table('orders').insert(order_data).execute()
+            order_id = order_response.data[0]['id']
+            
+            # Create order items with product images
+            order_items = []
+            for item in cart_response.data:
+                product_info = item.get('products', {})
+                product_name = product_info.get('name') if product_info else None
+                
+                # Get product image (prefer first from image_urls, fallback to image_url)
+                product_image = None
+                if product_info:
+                    image_urls = product_info.get('image_urls')
+                    if image_urls and isinstance(image_urls, list) and len(image_urls) > 0:
+                        product_image = image_urls[0]
+                    else:
+                        product_image = product_info.get('image_url')
+                
+                order_items.append({
+                    'order_id': order_id,
+                    'product_id': item['product_id'],
+                    'product_name': product_name,
+                    'product_image': product_image,
+                    'size': item.get('size'),
+                    'color': item.get('color'),
+                    'quantity': item['quantity'],
+                    'price': item['price']
+                })
+            
+            if order_items:
+                supabase.table('order_items').insert(order_items).execute()
+        except Exception:
+            abandon_order()
+            raise
         
-        order_response = supabase.table('orders').insert(order_data).execute()
+        if order_items:
+            try:
+                record_order_sales(order_id)
+            except Exception as e:
+                print(f"Warning: Could not update sales counters: {e}")
         
-        order_id = order_response.data[0]['id']
+        # Clear cart
+        supabase.table('cart_items').delete().eq('session_id', session_id).execute()
+        cart_changed(session_id)
         
-        # Create order items with product images
-        order_items = []
-        for item in cart_response.data:
-            product_info = item.get('products', {})
-            product_name = product_info.get('name') if product_info else None
-            
-            # Get product image (prefer first from image_urls, fallback to image_url)
-            product_image = None
-            if product_info:
-                image_urls = product_info.get('image_urls')
-                if image_urls and isinstance(image_urls, list) and len(image_urls) > 0:
-                    product_image = image_urls[0]
-                else:
-                    product_image = product_info.get('image_url')
+        return jsonify({
+            "success": True,
+            "message": "Order created successfully",
+            "order_id": order_id,
+            "order_summary": {
+                "subtotal": round(subtotal, 2),
+                "discount": round(discount, 2),
+                "discount_code": applied_discount.get('code') if applied_discount else None,
+                "delivery_fee": delivery_fee,
+                "total": round(total, 2)
+            }
+        }), 201
             
-            order_items.append({
-                'order_id': order_id,
-                'product_id': item['product_id'],
-                'product_name': product_name,
-                'product_image': product_image,
-                'size': item.get('size'),
-                'color': item.get('color'),
-                'quantity': item['quantity'],
-                'price': item['price']
-            })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route('/api/discounts/validate', methods=['POST'])
+def validate_discount():
+    """
+    Check a discount code for the promo code box (does not use it up)
+    Body: { "code": "SAVE20", "session_id": "xxx" } or { "code": "SAVE20", "subtotal": 120.5 }
+    Returns: code, type, value and the discount amount for the cart (or given subtotal)
+    """
+    try:
+        data = request.json
+        code = (data.get('code') or '').strip()
+        session_id = data.get('session_id')
+        
+        if not code or (not session_id and data.get('subtotal') is None):
+            return jsonify({
+                "success": False,
+                "message": "code and session_id (or subtotal) are required"
+            }), 400
         
-        if order_items:
-            supabase.table('order_items').insert(order_items).execute()
+        if session_id:
+            subtotal = sum(float(item['price']) * item['quantity'] for item in load_cart(session_id))
+        else:
+            try:
+                subtotal = float(data.get('subtotal'))
+            except (TypeError, ValueError):
+                subtotal = None
+            if subtotal is None or not math.isfinite(subtotal):
+                return jsonify({
+                    "success": False,
+                    "message": "subtotal must be a number"
+                }), 400
         
-        # Clear cart
-        supabase.table('cart_items').delete().eq('session_id', session_id).execute()
+        try:
+            discount, amount = get_discount_index().evaluate(code, subtotal)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
         
         return jsonify({
             "success": True,
-            "message": "Order created successfully",
-            "order_id": order_id,
-            "order_summary": {
+            "data": {
+                "code": discount.get('code'),
+                "type": discount.get('type') or 'percentage',
+                "value": discount.get('discount'),
                 "subtotal": round(subtotal, 2),
-                "discount": round(discount, 2),
-                "delivery_fee": delivery_fee,
-                "total": round(total, 2)
+                "discount": round(amount, 2)
             }
-        }), 201
+        }), 200
             
     except Exception as e:
         return jsonify({
@@ -908,11 +2725,17 @@ def get_order(order_id):
              Order items with product images, Subtotal, Shipping, Total
     """
     try:
-        # Get order with customer info
-        order_response = supabase.table('orders')\
-            .select('*, customers(*)')\
-            .eq('id', order_id)\
-            .execute()
+        # Get order with customer info and its items in parallel
+        order_response, items_response = run_concurrently(
+            lambda: supabase.table('orders')
+                .select('*, customers(*)')
+                .eq('id', order_id)
+                .execute(),
+            lambda: supabase.table('order_items')
+                .select('*')
+                .eq('order_id', order_id)
+                .execute()
+        )
         
         if not order_response.data:
             return jsonify({
@@ -923,12 +2746,6 @@ def get_order(order_id):
         order = order_response.data[0]
         customer = order.get('customers', {})
         
-        # Get order items with product details
-        items_response = supabase.table('order_items')\
-            .select('*')\
-            .eq('order_id', order_id)\
-            .execute()
-        
         # Format order items
         order_items = []
         for item in items_response.data:
@@ -1045,10 +2862,11 @@ def create_product():
         response = supabase.table('products').insert(product_data).execute()
         
         if response.data:
+            product_changed(response.data[0].get('id'))
             return jsonify({
                 "success": True,
                 "message": "Product created successfully",
-                "data": response.data[0]
+                "data": without_generated_columns(response.data[0])
             }), 201
         else:
             return jsonify({
@@ -1138,10 +2956,11 @@ def update_product(product_id):
         response = supabase.table('products').update(update_data).eq('id', product_id).execute()
         
         if response.data:
+            product_changed(product_id)
             return jsonify({
                 "success": True,
                 "message": "Product updated successfully",
-                "data": response.data[0]
+                "data": without_generated_columns(response.data[0])
             }), 200
         else:
             return jsonify({
@@ -1247,67 +3066,23 @@ def get_new_arrivals():
     Get 4 random New Arrival products
     Returns: Name, Rating (average), Image[2] (first 2 images), Price
     Note: Color field is NOT included in the response
+    Query params:
+    - rotation (optional) - Window in seconds; the same 4 products are returned for the
+      whole window (deterministic sample) and the response is cacheable until it ends
     """
     try:
-        import random
-        
-        # Get all active products with "New Arrival" tag
-        response = supabase.table('products').select('id, name, price, image_urls, color, tags').eq('status', 'active').execute()
+        rotation = request.args.get('rotation', type=int)
         
-        # Filter products with "New Arrival" tag
-        new_arrival_products = []
-        for product in response.data:
-            product_tags = product.get('tags', [])
-            if isinstance(product_tags, list):
-                # Check if "New Arrival" tag exists (case-insensitive)
-                if any('new arrival' in str(t).lower() for t in product_tags):
-                    new_arrival_products.append(product)
-            elif isinstance(product_tags, str) and 'new arrival' in product_tags.lower():
-                new_arrival_products.append(product)
-        
-        # Randomly select 4 products (or all if less than 4)
-        if len(new_arrival_products) > 4:
-            selected_products = random.sample(new_arrival_products, 4)
-        else:
-            selected_products = new_arrival_products
-        
-        # Process products to include ratings and format images
-        products_list = []
-        for product in selected_products:
-            product_id = product['id']
-            
-            # Get average rating from reviews
-            reviews_response = supabase.table('reviews')\
-                .select('rating')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            ratings = [r['rating'] for r in reviews_response.data if r.get('rating')]
-            average_rating = round(sum(ratings) / len(ratings), 1) if ratings else 0.0
-            
-            # Get first 2 images
-            image_urls = product.get('image_urls', [])
-            if isinstance(image_urls, list):
-                images = image_urls[:2]  # First 2 images
-            else:
-                # Fallback to single image_url if image_urls is not available
-                single_image = product.get('image_url')
-                images = [single_image] if single_image else []
-                images = images[:2]
-            
-            products_list.append({
-                'id': product.get('id'),
-                'name': product.get('name', ''),
-                'rating': average_rating,
-                'image': images,  # Array of max 2 images
-                'price': float(product.get('price', 0))
-            })
+        # Sample from the in-memory pool of active products tagged "New Arrival"
+        catalog = get_catalog_snapshot()
+        selected = sample_tag_pool(catalog, 'new arrival', 4, rotation)
+        products_list = [catalog.card(i) for i in selected]
         
         return jsonify({
             "success": True,
             "data": products_list,
             "count": len(products_list)
-        }), 200
+        }), 200, rotation_cache_headers(rotation)
             
     except Exception as e:
         return jsonify({
@@ -1324,15 +3099,10 @@ def get_best_selling_products():
     try:
         limit = request.args.get('limit', 4, type=int)
         
-        # Get all order items to calculate sales
-        items_response = supabase.table('order_items').select('product_id, quantity').execute()
-        from collections import defaultdict
-        sales_count = defaultdict(int)
-        for item in (items_response.data or []):
-            sales_count[item['product_id']] += item.get('quantity', 1)
-        
-        # Get top selling product IDs
-        top_product_ids = [pid for pid, _ in sorted(sales_count.items(), key=lambda x: x[1], reverse=True)[:limit]]
+        # Get top selling product IDs from the sales counters
+        top_sellers = get_sales_counters().top(limit)
+        sales_count = dict(top_sellers)
+        top_product_ids = [pid for pid, _ in top_sellers]
         
         if not top_product_ids:
             return jsonify({
@@ -1351,6 +3121,9 @@ def get_best_selling_products():
         # Create a map of product_id to product data
         products_map = {p['id']: p for p in products_response.data}
         
+        # Get average ratings for the top sellers in one query
+        ratings_map = get_average_ratings(list(products_map.keys()))
+
         # Process products in sales order
         products_list = []
         for product_id in top_product_ids:
@@ -1358,14 +3131,7 @@ def get_best_selling_products():
             if not product:
                 continue
             
-            # Get average rating from reviews
-            reviews_response = supabase.table('reviews')\
-                .select('rating')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            ratings = [r['rating'] for r in reviews_response.data if r.get('rating')]
-            average_rating = round(sum(ratings) / len(ratings), 1) if ratings else 0.0
+            average_rating = ratings_map.get(product_id, 0.0)
             
             # Get first 2 images
             image_urls = product.get('image_urls', [])
@@ -1405,67 +3171,23 @@ def get_featured_products():
     Get 4 random Featured Product products
     Returns: Name, Rating (average), Image[2] (first 2 images), Price
     Note: Color field is NOT included in the response
+    Query params:
+    - rotation (optional) - Window in seconds; the same 4 products are returned for the
+      whole window (deterministic sample) and the response is cacheable until it ends
     """
     try:
-        import random
-        
-        # Get all active products with "Featured Product" tag
-        response = supabase.table('products').select('id, name, price, image_urls, color, tags').eq('status', 'active').execute()
-        
-        # Filter products with "Featured Product" tag
-        featured_products = []
-        for product in response.data:
-            product_tags = product.get('tags', [])
-            if isinstance(product_tags, list):
-                # Check if "Featured Product" tag exists (case-insensitive)
-                if any('featured product' in str(t).lower() for t in product_tags):
-                    featured_products.append(product)
-            elif isinstance(product_tags, str) and 'featured product' in product_tags.lower():
-                featured_products.append(product)
-        
-        # Randomly select 4 products (or all if less than 4)
-        if len(featured_products) > 4:
-            selected_products = random.sample(featured_products, 4)
-        else:
-            selected_products = featured_products
+        rotation = request.args.get('rotation', type=int)
         
-        # Process products to include ratings and format images
-        products_list = []
-        for product in selected_products:
-            product_id = product['id']
-            
-            # Get average rating from reviews
-            reviews_response = supabase.table('reviews')\
-                .select('rating')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            ratings = [r['rating'] for r in reviews_response.data if r.get('rating')]
-            average_rating = round(sum(ratings) / len(ratings), 1) if ratings else 0.0
-            
-            # Get first 2 images
-            image_urls = product.get('image_urls', [])
-            if isinstance(image_urls, list):
-                images = image_urls[:2]  # First 2 images
-            else:
-                # Fallback to single image_url if image_urls is not available
-                single_image = product.get('image_url')
-                images = [single_image] if single_image else []
-                images = images[:2]
-            
-            products_list.append({
-                'id': product.get('id'),
-                'name': product.get('name', ''),
-                'rating': average_rating,
-                'image': images,  # Array of max 2 images
-                'price': float(product.get('price', 0))
-            })
+        # Sample from the in-memory pool of active products tagged "Featured Product"
+        catalog = get_catalog_snapshot()
+        selected = sample_tag_pool(catalog, 'featured product', 4, rotation)
+        products_list = [catalog.card(i) for i in selected]
         
         return jsonify({
             "success": True,
             "data": products_list,
             "count": len(products_list)
-        }), 200
+        }), 200, rotation_cache_headers(rotation)
             
     except Exception as e:
         return jsonify({
@@ -1474,31 +3196,26 @@ def get_featured_products():
         }), 500
 
 @app.route('/api/products/categories', methods=['GET'])
+@cached_response('categories')
 def get_product_categories():
     """
     Get all distinct categories from active products
-    Returns: List of unique category names
+    Returns: List of unique category names, plus active product counts per category
     """
     try:
-        # Get all active products with their categories
-        response = supabase.table('products')\
-            .select('category')\
-            .eq('status', 'active')\
+        # Read the trigger-maintained registry (see product_category_counts.sql)
+        response = supabase.table('product_category_counts')\
+            .select('category, active_count')\
+            .gt('active_count', 0)\
+            .order('category')\
             .execute()
         
-        # Extract unique categories
-        categories = set()
-        for product in (response.data or []):
-            category = product.get('category')
-            if category:
-                categories.add(category)
-        
-        # Convert to sorted list
-        categories_list = sorted(list(categories))
+        rows = response.data or []
         
         return jsonify({
             "success": True,
-            "data": categories_list
+            "data": [row['category'] for row in rows],
+            "counts": {row['category']: row['active_count'] for row in rows}
         }), 200
     except Exception as e:
         return jsonify({
@@ -1507,6 +3224,7 @@ def get_product_categories():
         }), 500
 
 @app.route('/api/products', methods=['GET'])
+@cached_response()
 def get_all_products():
     """
     Get products with filters and pagination
@@ -1514,209 +3232,56 @@ def get_all_products():
     
     Query params: 
     - page (optional, default: 1) - Page number
+    - cursor (optional) - Opaque cursor from pagination.next_cursor; takes precedence over page
     - limit (optional, default: 9) - Items per page
     - category (optional) - Filter by category
     - min_price (optional) - Minimum price filter
     - max_price (optional) - Maximum price filter
     - color (optional) - Filter by color
     - tag (optional) - Filter by tag (e.g., "Featured Product", "New Arrival")
+    - sort (optional) - "newest", "oldest", "price_high_low", "price_low_high", "rating_high_low", "best_selling"
     """
     try:
         page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor')
         limit = request.args.get('limit', 9, type=int)  # Default 9 per page
-        category = request.args.get('category')
-        min_price = request.args.get('min_price', type=float)
-        max_price = request.args.get('max_price', type=float)
-        color = request.args.get('color')
-        tag = request.args.get('tag')  # Filter by tag
+        filters = parse_product_filters(request.args)
+        category = filters['category']
+        min_price = filters['min_price']
+        max_price = filters['max_price']
+        color = filters['color']
+        tag = filters['tag']  # Filter by tag
         
-        # Calculate offset
-        offset = (page - 1) * limit
+        add_cache_tags(f'category:{category}' if category else 'catalog')
         
-        # Build query - only show active products for users
-        query = supabase.table('products').select('id, name, price, image_urls, category, color, tags', count='exact')
-        query = query.eq('status', 'active')  # Only show active products
-        
-        # Apply filters (color and tag filters will be applied in Python for JSONB arrays)
-        if category:
-            query = query.eq('category', category)
-        if min_price is not None:
-            query = query.gte('price', min_price)
-        if max_price is not None:
-            query = query.lte('price', max_price)
-        # Color filter: check if color array contains the specified color
-        # For JSONB arrays, we'll filter in Python after fetching
-        color_filter_applied = color is not None
-        tag_filter_applied = tag is not None
-        
-        # Get total count with filters (color and tag filters will be recalculated)
-        count_query = supabase.table('products').select('id', count='exact')
-        count_query = count_query.eq('status', 'active')  # Only count active products
-        if category:
-            count_query = count_query.eq('category', category)
-        if min_price is not None:
-            count_query = count_query.gte('price', min_price)
-        if max_price is not None:
-            count_query = count_query.lte('price', max_price)
-        # Note: color filter will be applied in Python
-        
-        # Get paginated data (fetch more if filters are applied to filter in Python)
-        fetch_limit = limit * 3 if (color_filter_applied or tag_filter_applied) else limit
+        # Filter the in-process catalog snapshot (active products only)
+        catalog = get_catalog_snapshot()
+        matches = catalog.filter(category=category, min_price=min_price, max_price=max_price,
+                                 color=color, tag=tag)
+        total_count = catalog.count(matches)
         
         # Apply sorting
-        sort_param = request.args.get('sort', 'newest')
-        if sort_param == 'price_high_low':
-            query = query.order('price', desc=True)
-        elif sort_param == 'price_low_high':
-            query = query.order('price', desc=False)
-        elif sort_param == 'newest':
-            query = query.order('created_at', desc=True)
-        elif sort_param == 'oldest':
-            query = query.order('created_at', desc=False)
-        elif sort_param == 'best_selling':
-            # For best selling, we'll sort by created_at first, then sort by sales in Python
-            query = query.order('created_at', desc=True)
+        sort_param = filters['sort']
+        if sort_param == 'best_selling':
+            # Rank by units sold, newest first among equal sellers
+            sales = get_sales_counters()
+            ranked = sorted(catalog.ordered(matches, 'newest'),
+                            key=lambda i: sales.get(catalog.ids[i]), reverse=True)
         else:
-            # Default to newest
-            query = query.order('created_at', desc=True)
+            ranked = None
         
-        response = query.range(offset, offset + fetch_limit).execute()
-        
-        # Get sales data for best_selling sort
-        sales_data = {}
-        if sort_param == 'best_selling':
-            items_response = supabase.table('order_items').select('product_id, quantity').execute()
-            from collections import defaultdict
-            sales_count = defaultdict(int)
-            for item in (items_response.data or []):
-                sales_count[item['product_id']] += item.get('quantity', 1)
-            sales_data = dict(sales_count)
-        
-        # Process products to include ratings and format images
-        products_list = []
-        for product in response.data:
-            # Apply color filter if specified
-            if color_filter_applied:
-                product_colors = product.get('color', [])
-                if isinstance(product_colors, list):
-                    # Check if the specified color exists in the array (case-insensitive)
-                    if color.lower() not in [c.lower() if isinstance(c, str) else str(c).lower() for c in product_colors]:
-                        continue
-                elif isinstance(product_colors, str):
-                    if product_colors.lower() != color.lower():
-                        continue
-                else:
-                    continue
-            
-            # Apply tag filter if specified
-            if tag_filter_applied:
-                product_tags = product.get('tags', [])
-                if isinstance(product_tags, list):
-                    if tag.lower() not in [t.lower() if isinstance(t, str) else str(t).lower() for t in product_tags]:
-                        continue
-                elif isinstance(product_tags, str):
-                    if product_tags.lower() != tag.lower():
-                        continue
-                else:
-                    continue
-            product_id = product['id']
-            
-            # Get average rating from reviews
-            reviews_response = supabase.table('reviews')\
-                .select('rating')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            ratings = [r['rating'] for r in reviews_response.data if r.get('rating')]
-            average_rating = round(sum(ratings) / len(ratings), 1) if ratings else 0.0
-            
-            # Get images (max 2)
-            image_urls = product.get('image_urls', [])
-            if isinstance(image_urls, list):
-                images = image_urls[:2]  # Take first 2 images
-            else:
-                # Fallback to single image_url if image_urls is not available
-                single_image = product.get('image_url')
-                images = [single_image] if single_image else []
-            
-            product_data = {
-                'id': product.get('id'),  # Include product ID
-                'name': product.get('name', ''),
-                'rating': average_rating,
-                'image': images,  # Array of max 2 images
-                'price': float(product.get('price', 0))
-            }
-            
-            # Add sales count for best_selling sort
-            if sort_param == 'best_selling':
-                product_data['_sales_count'] = sales_data.get(product.get('id'), 0)
-            
-            products_list.append(product_data)
-            
-            # Stop if we have enough items (but not for best_selling, we need to sort first)
-            if sort_param != 'best_selling' and len(products_list) >= limit:
-                break
+        try:
+            page_positions, offset, next_cursor = page_catalog(
+                catalog, matches, sort_param, page, limit, cursor, ranked=ranked)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+        if cursor:
+            page = offset // limit + 1 if limit > 0 else 1
         
-        # Sort by sales if best_selling
-        if sort_param == 'best_selling':
-            products_list.sort(key=lambda x: x.get('_sales_count', 0), reverse=True)
-            # Remove the temporary _sales_count field
-            for p in products_list:
-                p.pop('_sales_count', None)
-            # Take only the requested limit
-            products_list = products_list[:limit]
-        
-        # Recalculate total count if tag or color filter is applied
-        if tag_filter_applied or color_filter_applied:
-            all_products = supabase.table('products').select('id, tags, color, price, category').eq('status', 'active').execute()
-            filtered_count = 0
-            for p in all_products.data:
-                # Apply category filter
-                if category and p.get('category') != category:
-                    continue
-                
-                # Apply price filters
-                product_price = float(p.get('price', 0))
-                if min_price is not None and product_price < min_price:
-                    continue
-                if max_price is not None and product_price > max_price:
-                    continue
-                
-                # Apply color filter
-                if color_filter_applied:
-                    p_colors = p.get('color', [])
-                    if isinstance(p_colors, list):
-                        if color.lower() not in [c.lower() if isinstance(c, str) else str(c).lower() for c in p_colors]:
-                            continue
-                    elif isinstance(p_colors, str):
-                        if p_colors.lower() != color.lower():
-                            continue
-                    else:
-                        continue
-                
-                # Apply tag filter
-                if tag_filter_applied:
-                    p_tags = p.get('tags', [])
-                    if isinstance(p_tags, list):
-                        if tag.lower() not in [t.lower() if isinstance(t, str) else str(t).lower() for t in p_tags]:
-                            continue
-                    elif isinstance(p_tags, str):
-                        if p_tags.lower() != tag.lower():
-                            continue
-                    else:
-                        continue
-                
-                filtered_count += 1
-            total_count = filtered_count
-        else:
-            # Get count from the query response
-            count_result = count_query.execute()
-            # Supabase returns count in the response
-            if hasattr(count_result, 'count') and count_result.count is not None:
-                total_count = count_result.count
-            else:
-                # Fallback: count the actual data returned
-                total_count = len(count_result.data) if count_result.data else 0
+        products_list = [catalog.card(i) for i in page_positions]
         
         # Calculate total pages
         total_pages = (total_count + limit - 1) // limit if total_count > 0 else 0
@@ -1730,7 +3295,8 @@ def get_all_products():
                 "total": total_count,
                 "total_pages": total_pages,
                 "has_next": page < total_pages,
-                "has_prev": page > 1
+                "has_prev": page > 1,
+                "next_cursor": next_cursor
             },
             "count": len(products_list),
             "filters_applied": {
@@ -2195,12 +3761,41 @@ def user_wishlist():
 # SEARCH APIs
 # ============================================
 
+@app.route('/api/products/suggest', methods=['GET'])
+def suggest_products():
+    """
+    Typeahead suggestions for the header search box
+    Query params: q (what the user has typed so far), limit (optional, default and max: 10)
+    Returns: Product names and categories starting with q (at any word), best sellers first
+    """
+    try:
+        query = request.args.get('q', '')
+        limit = min(max(request.args.get('limit', SUGGEST_TOP_N, type=int), 0), SUGGEST_TOP_N)
+        
+        return jsonify({
+            "success": True,
+            "data": get_suggest_index().complete(query, limit)
+        }), 200
+            
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @app.route('/api/products/search', methods=['GET'])
+@cached_response()
 def search_products():
     """
-    Search products by name with real-time suggestions
-    Query params: q (search query), limit (optional, default: 10)
-    Returns: List of matching products with id, name, price, image_urls
+    Search products with real-time suggestions, ranked by relevance
+    Matches name, category, tags, colors and description; every word must match,
+    and the last word also matches as a prefix while the user is typing.
+    Misspelled words are rewritten to the closest catalog word ("hodie" -> "hoodie").
+    Query params: q (search query), limit (optional, default: 10),
+    category, min_price, max_price, color, tag (optional, same as /api/products/filter),
+    typo (optional, default: true) - Set to "false" to disable spelling correction
+    Returns: List of matching products with id, name, price, image, category,
+    and corrected_query (the query actually searched, or null if q was used as typed)
     """
     try:
         query = request.args.get('q', '').strip()
@@ -2212,34 +3807,38 @@ def search_products():
                 "data": []
             }), 200
         
-        # Search products by name (case-insensitive) - only active products
-        response = supabase.table('products')\
-            .select('id, name, price, image_urls, image_url, category')\
-            .eq('status', 'active')\
-            .ilike('name', f'%{query}%')\
-            .limit(limit)\
-            .execute()
+        filters = parse_product_filters(request.args)
+        add_cache_tags(f"category:{filters['category']}" if filters['category'] else 'catalog')
+        
+        # Rank active products matching the filters from the snapshot's search index
+        catalog = get_catalog_snapshot()
+        allowed = catalog.filter(category=filters['category'], min_price=filters['min_price'],
+                                 max_price=filters['max_price'], color=filters['color'],
+                                 tag=filters['tag'])
+        index = catalog.search_index
+        corrected_query = None
+        if request.args.get('typo', 'true').lower() != 'false':
+            corrected_query = index.correct(query)
+        scores = index.search(corrected_query or query, allowed)
+        top = heapq.nsmallest(max(limit, 0), scores, key=lambda i: (-scores[i], catalog.ids[i]))
         
         # Format products
         products = []
-        for product in response.data or []:
-            image_urls = product.get('image_urls', [])
-            if isinstance(image_urls, list) and len(image_urls) > 0:
-                image = image_urls[0]
-            else:
-                image = product.get('image_url') or '/placeholder.svg'
-            
+        for i in top:
+            images = catalog.images[i]
             products.append({
-                'id': product['id'],
-                'name': product['name'],
-                'price': float(product.get('price', 0)),
-                'image': image,
-                'category': product.get('category', '')
+                'id': catalog.ids[i],
+                'name': catalog.names[i],
+                'price': catalog.prices[i],
+                'image': images[0] if images else '/placeholder.svg',
+                'category': catalog.categories[catalog.category_codes[i]] or ''
             })
         
         return jsonify({
             "success": True,
-            "data": products
+            "data": products,
+            "total": len(scores),
+            "corrected_query": corrected_query
         }), 200
             
     except Exception as e:
@@ -2447,32 +4046,34 @@ def test():
 
 @app.route('/api/admin/products', methods=['GET', 'POST'])
 def admin_products():
-    """Get all products or create a new product"""
+    """
+    Get all products or create a new product
+    GET query params: page, limit, search, category, status, min_price, max_price, color, tag, sort,
+    include_sizes (true to add size_stocks per product)
+    """
     try:
         if request.method == 'GET':
             page = request.args.get('page', 1, type=int)
             limit = request.args.get('limit', 20, type=int)
-            search = request.args.get('search', '')
-            category = request.args.get('category', '')
             offset = (page - 1) * limit
             
-            query = supabase.table('products').select('*', count='exact')
-            
-            if search:
-                query = query.ilike('name', f'%{search}%')
-            if category:
-                query = query.eq('category', category)
+            products, total = query_products('*', parse_product_filters(request.args), offset, limit)
+            products = [without_generated_columns(product) for product in products]
             
-            response = query.order('created_at', desc=True).range(offset, offset + limit - 1).execute()
+            # Per-size availability for the whole page in one query
+            if request.args.get('include_sizes', 'false').lower() == 'true':
+                size_stocks = load_size_stocks([p['id'] for p in products])
+                for product in products:
+                    product['size_stocks'] = size_stocks[product['id']]
             
             return jsonify({
                 "success": True,
-                "data": response.data or [],
+                "data": products,
                 "pagination": {
                     "page": page,
                     "limit": limit,
-                    "total": response.count or 0,
-                    "total_pages": ((response.count or 0) + limit - 1) // limit
+                    "total": total,
+                    "total_pages": (total + limit - 1) // limit
                 }
             }), 200
         
@@ -2493,9 +4094,10 @@ def admin_products():
                 'status': data.get('status', 'active')
             }
             response = supabase.table('products').insert(product_data).execute()
+            product_changed(response.data[0].get('id') if response.data else None)
             return jsonify({
                 "success": True,
-                "data": response.data[0] if response.data else None,
+                "data": without_generated_columns(response.data[0]) if response.data else None,
                 "message": "Product created successfully"
             }), 201
     except Exception as e:
@@ -2511,56 +4113,14 @@ def admin_product_detail(product_id):
             if not response.data:
                 return jsonify({"success": False, "message": "Product not found"}), 404
             
-            product_data = response.data[0]
+            product_data = without_generated_columns(response.data[0])
             
             # Fetch product size stock if product has size_chart_template_id
             if product_data.get('size_chart_template_id'):
                 try:
-                    # Get product_sizes with stock - use a simpler query
-                    product_sizes_response = supabase.table('product_sizes')\
-                        .select('id, size_chart_row_id')\
-                        .eq('product_id', product_id)\
-                        .execute()
-                    
-                    # Format size stock data
-                    size_stocks = []
-                    if product_sizes_response.data:
-                        for ps in product_sizes_response.data:
-                            product_size_id = ps['id']
-                            row_id = ps['size_chart_row_id']
-                            
-                            # Get size label from size_chart_rows
-                            row_response = supabase.table('size_chart_rows')\
-                                .select('size_label')\
-                                .eq('id', row_id)\
-                                .execute()
-                            
-                            size_label = ''
-                            if row_response.data and len(row_response.data) > 0:
-                                size_label = row_response.data[0].get('size_label', '')
-                            
-                            # Get stock from product_size_stock
-                            stock_response = supabase.table('product_size_stock')\
-                                .select('stock_quantity')\
-                                .eq('product_size_id', product_size_id)\
-                                .execute()
-                            
-                            stock_value = 0
-                            if stock_response.data and len(stock_response.data) > 0:
-                                stock_value = stock_response.data[0].get('stock_quantity', 0)
-                            
-                            if size_label:  # Only add if we have a valid size label
-                                size_stocks.append({
-                                    'row_id': row_id,
-                                    'size_label': size_label,
-                                    'stock': stock_value
-                                })
-                    
-                    product_data['size_stocks'] = size_stocks
+                    product_data['size_stocks'] = load_size_stocks([product_id])[product_id]
                 except Exception as e:
                     print(f"Warning: Could not fetch size stocks: {e}")
-                    import traceback
-                    traceback.print_exc()
                     product_data['size_stocks'] = []
             else:
                 product_data['size_stocks'] = []
@@ -2569,7 +4129,8 @@ def admin_product_detail(product_id):
         
         elif request.method == 'PUT':
             data = request.json
-            update_data = {k: v for k, v in data.items() if k not in ['size_stocks', 'size_chart_template_id'] and v is not None}
+            excluded = ['size_stocks', 'size_chart_template_id', *PRODUCT_GENERATED_COLUMNS]
+            update_data = {k: v for k, v in data.items() if k not in excluded and v is not None}
             
             # Handle size_chart_template_id
             if 'size_chart_template_id' in data:
@@ -2629,14 +4190,50 @@ def admin_product_detail(product_id):
                 except Exception as e:
                     print(f"Warning: Could not update size stock: {e}")
             
-            return jsonify({"success": True, "data": response.data[0] if response.data else None}), 200
+            product_changed(product_id)
+            return jsonify({"success": True, "data": without_generated_columns(response.data[0]) if response.data else None}), 200
         
         elif request.method == 'DELETE':
+            # The delete cascades to the neighbor rows that point at this product, so
+            # find the lists that include it first; they are recomputed without it
+            try:
+                referrers = product_neighbor_referrers(product_id)
+            except Exception as e:
+                print(f"Warning: Could not read products related to {product_id}: {e}")
+                referrers = None
             supabase.table('products').delete().eq('id', product_id).execute()
+            product_changed(product_id, neighbor_referrers=referrers)
             return jsonify({"success": True, "message": "Product deleted"}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/admin/products/rebuild-categories', methods=['POST'])
+def admin_rebuild_category_counts():
+    """Rebuild the category registry from the products table"""
+    try:
+        response = supabase.rpc('rebuild_product_category_counts', {}).execute()
+        invalidate_response_cache('categories')
+        return jsonify({
+            "success": True,
+            "data": {"categories": response.data},
+            "message": "Category counts rebuilt"
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/admin/products/rebuild-neighbors', methods=['POST'])
+def admin_rebuild_product_neighbors():
+    """Recompute the related products (similarity neighbors) of every active product"""
+    try:
+        rebuilt = rebuild_product_neighbors()
+        return jsonify({
+            "success": True,
+            "data": {"products": rebuilt},
+            "message": "Related products rebuilt"
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 
 # ============================================
 # ADMIN ORDERS APIs
@@ -2707,20 +4304,40 @@ def admin_order_detail(order_id):
 
 @app.route('/api/admin/orders/<order_id>/status', methods=['PUT'])
 def admin_order_status(order_id):
-    """Update order status"""
+    """Update order status (cancelling/returning an order takes its items out of the sales counters)"""
     try:
         data = request.json
         status = data.get('status')
-        response = supabase.table('orders').update({'status': status}).eq('id', order_id).execute()
+        # Status and sales counters change in one locked transaction, so concurrent
+        # updates of the same order cannot both count its items in or out
+        response = supabase.rpc('set_order_status', {'p_order_id': order_id, 'p_status': status}).execute()
+        result = response.data or {}
+        store_sales_totals(result.get('sales'))
+        
         return jsonify({
             "success": True,
-            "data": response.data[0] if response.data else None,
+            "data": result.get('order'),
             "message": "Order status updated"
         }), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route('/api/admin/orders/rebuild-sales', methods=['POST'])
+def admin_rebuild_sales_counters():
+    """Rebuild product sales counters from order_items"""
+    try:
+        response = supabase.rpc('rebuild_product_sales_counters', {}).execute()
+        reset_sales_counters()
+        return jsonify({
+            "success": True,
+            "data": {"products": response.data},
+            "message": "Sales counters rebuilt"
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 # ============================================
 # ADMIN CUSTOMERS APIs
 # ============================================
@@ -2794,12 +4411,16 @@ def admin_customers_stats():
 def admin_dashboard_stats():
     """Get dashboard statistics"""
     try:
-        products_response = supabase.table('products').select('id, stock, price', count='exact').execute()
+        products_response, orders_response, customers_response = run_concurrently(
+            lambda: supabase.table('products').select('id, stock, price', count='exact').execute(),
+            lambda: supabase.table('orders').select('id, status, total', count='exact').execute(),
+            lambda: supabase.table('customers').select('id', count='exact').execute()
+        )
+        
         products = products_response.data or []
         total_products = products_response.count or len(products)
         low_stock_count = sum(1 for p in products if 0 < (p.get('stock') or 0) <= 10)
         
-        orders_response = supabase.table('orders').select('id, status, total', count='exact').execute()
         orders = orders_response.data or []
         total_orders = orders_response.count or len(orders)
         total_revenue = sum(float(o.get('total', 0)) for o in orders if o.get('status') not in ['cancelled', 'failed'])
@@ -2808,7 +4429,6 @@ def admin_dashboard_stats():
         failed_orders = sum(1 for o in orders if o.get('status') == 'failed')
         returned_orders = sum(1 for o in orders if o.get('status') == 'returned')
         
-        customers_response = supabase.table('customers').select('id', count='exact').execute()
         new_customers = customers_response.count or 0
         
         return jsonify({
@@ -2863,17 +4483,18 @@ def admin_dashboard_best_selling():
     """Get best selling products"""
     try:
         limit = request.args.get('limit', 5, type=int)
-        products_response = supabase.table('products').select('id, name, stock').execute()
-        products = {p['id']: p for p in (products_response.data or [])}
+        top_sellers = get_sales_counters().top(limit)
         
-        items_response = supabase.table('order_items').select('product_id, quantity').execute()
-        from collections import defaultdict
-        sales_count = defaultdict(int)
-        for item in (items_response.data or []):
-            sales_count[item['product_id']] += item.get('quantity', 1)
+        products = {}
+        if top_sellers:
+            products_response = supabase.table('products')\
+                .select('id, name, stock')\
+                .in_('id', [pid for pid, _ in top_sellers])\
+                .execute()
+            products = {p['id']: p for p in (products_response.data or [])}
         
         best_selling = []
-        for product_id, sales in sorted(sales_count.items(), key=lambda x: x[1], reverse=True)[:limit]:
+        for product_id, sales in top_sellers:
             product = products.get(product_id, {})
             best_selling.append({
                 "id": product_id,
@@ -2934,7 +4555,7 @@ def admin_discounts():
             discount_data = {
                 'code': data.get('code'),
                 'discount': data.get('discount'),
-                'type': data.get('type', 'percentage'),
+                'type': data.get('type') or 'percentage',
                 'expiration_date': data.get('expiration_date'),
                 'status': 'active',
                 'usage_limit': data.get('usage_limit', 100),
@@ -2942,6 +4563,7 @@ def admin_discounts():
                 'min_order_value': data.get('min_order_value', 0)
             }
             response = supabase.table('discounts').insert(discount_data).execute()
+            discounts_changed()
             return jsonify({
                 "success": True,
                 "data": response.data[0] if response.data else None,
@@ -2993,15 +4615,161 @@ def admin_discount_detail(discount_id):
             data = request.json
             update_data = {k: v for k, v in data.items() if v is not None}
             response = supabase.table('discounts').update(update_data).eq('id', discount_id).execute()
+            discounts_changed()
             return jsonify({"success": True, "data": response.data[0] if response.data else None}), 200
         
         elif request.method == 'DELETE':
             supabase.table('discounts').delete().eq('id', discount_id).execute()
+            discounts_changed()
             return jsonify({"success": True, "message": "Discount deleted"}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# ============================================
+# ADMIN REVIEWS APIs
+# ============================================
+
+REVIEW_IMPORT_BATCH_SIZE = int(os.getenv('REVIEW_IMPORT_BATCH_SIZE', 500))
+REVIEW_IMPORT_MAX_ERRORS = 100  # Rejected lines reported back in detail
+
+def parse_import_review(line, products):
+    """
+    Validate one NDJSON review line
+    Returns: (review row, None) or (None, error message)
+    """
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None, "Invalid JSON"
+    if not isinstance(data, dict):
+        return None, "Each line must be a JSON object"
+    
+    product_id = data.get('product_id')
+    user_name = data.get('user_name')
+    rating = data.get('rating')
+    if not product_id or not user_name or rating is None:
+        return None, "product_id, user_name and rating are required"
+    if product_id not in products:
+        return None, "Product not found"
+    if isinstance(rating, bool) or not isinstance(rating, int) or rating < 1 or rating > 5:
+        return None, "Rating must be an integer between 1 and 5"
+    
+    posted_date = data.get('posted_date') or datetime.now().date().isoformat()
+    try:
+        posted_date = datetime.fromisoformat(str(posted_date)).date().isoformat()
+    except ValueError:
+        return None, "posted_date must be an ISO date"
+    
+    return {
+        'product_id': product_id,
+        'user_name': str(user_name),
+        'rating': rating,
+        'comment': str(data.get('comment') or ''),
+        'posted_date': posted_date
+    }, None
+
+@app.route('/api/admin/reviews/import', methods=['POST'])
+def admin_import_reviews():
+    """
+    Bulk import reviews (e.g. migrated from marketplaces)
+    Body: NDJSON, one review per line:
+          { "product_id": "...", "user_name": "John Doe", "rating": 5, "comment": "...", "posted_date": "2024-01-31" }
+    Query params: batch_size (optional, default: 500) - Reviews per insert
+    Invalid lines are skipped and reported; rating summaries and caches are refreshed
+    once per affected product after all batches are inserted.
+    """
+    try:
+        batch_size = min(max(request.args.get('batch_size', REVIEW_IMPORT_BATCH_SIZE, type=int), 1), 5000)
+        products = get_catalog_snapshot().position  # Every existing product id
+        
+        imported = 0
+        rejected = 0
+        errors = []
+        affected = set()
+        batch = []
+        
+        def reject(line_number, message):
+            nonlocal rejected
+            rejected += 1
+            if len(errors) < REVIEW_IMPORT_MAX_ERRORS:
+                errors.append({"line": line_number, "message": message})
+        
+        def flush():
+            nonlocal imported, batch
+            rows, batch = batch, []
+            try:
+                supabase.table('reviews').insert([review for _, review in rows]).execute()
+            except Exception as e:
+                for line_number, _ in rows:
+                    reject(line_number, f"Insert failed: {e}")
+                return
+            imported += len(rows)
+            affected.update(review['product_id'] for _, review in rows)
+        
+        # Validate while streaming the body, inserting a batch whenever one fills up
+        for line_number, raw_line in enumerate(request.stream, start=1):
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            review, error = parse_import_review(line, products)
+            if error:
+                reject(line_number, error)
+                continue
+            batch.append((line_number, review))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        
+        # One aggregate refresh per affected product, then one cache invalidation each
+        rating_stats = {}
+        affected = sorted(affected)
+        try:
+            for start in range(0, len(affected), batch_size):
+                response = supabase.rpc('refresh_product_rating_summaries', {
+                    'p_product_ids': affected[start:start + batch_size]
+                }).execute()
+                for row in (response.data or []):
+                    count = row.get('rating_count') or 0
+                    rating_stats[row['product_id']] = {
+                        'average': (row.get('rating_sum') or 0) / count if count else 0.0,
+                        'count': count
+                    }
+            refresh_catalog_ratings(rating_stats)
+        except Exception as e:
+            print(f"Warning: Could not refresh rating summaries after import: {e}")
+        for product_id in affected:
+            reviews_changed(product_id)
+        
+        return jsonify({
+            "success": True,
+            "data": {
+                "imported": imported,
+                "rejected": rejected,
+                "products": len(affected),
+                "errors": errors
+            },
+            "message": f"Imported {imported} reviews"
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/admin/reviews/rebuild-summaries', methods=['POST'])
+def admin_rebuild_rating_summaries():
+    """Rebuild product rating summaries from the reviews table"""
+    try:
+        response = supabase.rpc('rebuild_product_rating_summaries', {}).execute()
+        product_changed()
+        return jsonify({
+            "success": True,
+            "data": {"products": response.data},
+            "message": "Rating summaries rebuilt"
+        }), 200
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 # ============================================
 # SIZE CHART MANAGEMENT APIs
 # ============================================
@@ -3034,34 +4802,14 @@ def admin_size_chart_template(template_id):
     """Get, update or delete a size chart template"""
     try:
         if request.method == 'GET':
-            template_response = supabase.table('size_chart_templates').select('*').eq('id', template_id).execute()
-            if not template_response.data:
+            grid = get_size_chart_grid(template_id)
+            if grid is None:
                 return jsonify({"success": False, "message": "Template not found"}), 404
             
-            template = template_response.data[0]
-            rows_response = supabase.table('size_chart_rows').select('*').eq('template_id', template_id).order('sort_order').execute()
-            columns_response = supabase.table('size_chart_columns').select('*').eq('template_id', template_id).order('sort_order').execute()
-            
-            rows = rows_response.data or []
-            columns = columns_response.data or []
-            row_ids = [r['id'] for r in rows]
-            
-            values_grid = {}
-            if row_ids:
-                values_response = supabase.table('size_chart_values').select('*').in_('row_id', row_ids).execute()
-                row_map = {r['id']: r['size_label'] for r in rows}
-                col_map = {c['id']: c['column_key'] for c in columns}
-                for val in (values_response.data or []):
-                    row_label = row_map.get(val['row_id'])
-                    col_key = col_map.get(val['column_id'])
-                    if row_label and col_key:
-                        if row_label not in values_grid:
-                            values_grid[row_label] = {}
-                        values_grid[row_label][col_key] = val['value']
-            
-            template['rows'] = rows
-            template['columns'] = columns
-            template['values_grid'] = values_grid
+            template = dict(grid['template'])
+            template['rows'] = grid['rows']
+            template['columns'] = grid['columns']
+            template['values_grid'] = grid['values_grid']
             
             return jsonify({"success": True, "data": template}), 200
         
@@ -3071,6 +4819,7 @@ def admin_size_chart_template(template_id):
             if 'name' in data: update_data['name'] = data['name']
             if 'description' in data: update_data['description'] = data['description']
             response = supabase.table('size_chart_templates').update(update_data).eq('id', template_id).execute()
+            size_chart_changed(template_id)
             return jsonify({"success": True, "data": response.data[0] if response.data else None}), 200
         
         elif request.method == 'DELETE':
@@ -3081,6 +4830,7 @@ def admin_size_chart_template(template_id):
             supabase.table('size_chart_rows').delete().eq('template_id', template_id).execute()
             supabase.table('size_chart_columns').delete().eq('template_id', template_id).execute()
             supabase.table('size_chart_templates').delete().eq('id', template_id).execute()
+            size_chart_changed(template_id)
             return jsonify({"success": True, "message": "Template deleted"}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -3096,6 +4846,7 @@ def admin_size_chart_add_row(template_id):
             'size_label': data.get('size_label'),
             'sort_order': data.get('sort_order', 0)
         }).execute()
+        size_chart_changed(template_id)
         return jsonify({"success": True, "data": response.data[0] if response.data else None}), 201
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -3107,6 +4858,7 @@ def admin_size_chart_delete_row(template_id, row_id):
     try:
         supabase.table('size_chart_values').delete().eq('row_id', row_id).execute()
         supabase.table('size_chart_rows').delete().eq('id', row_id).execute()
+        size_chart_changed(template_id)
         return jsonify({"success": True, "message": "Row deleted"}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -3124,6 +4876,7 @@ def admin_size_chart_add_column(template_id):
             'unit': data.get('unit', 'cm'),
             'sort_order': data.get('sort_order', 0)
         }).execute()
+        size_chart_changed(template_id)
         return jsonify({"success": True, "data": response.data[0] if response.data else None}), 201
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -3135,6 +4888,7 @@ def admin_size_chart_delete_column(template_id, column_id):
     try:
         supabase.table('size_chart_values').delete().eq('column_id', column_id).execute()
         supabase.table('size_chart_columns').delete().eq('id', column_id).execute()
+        size_chart_changed(template_id)
         return jsonify({"success": True, "message": "Column deleted"}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -3163,6 +4917,7 @@ def admin_size_chart_update_values(template_id):
                         'value': value
                     }).execute()
         
+        size_chart_changed(template_id)
         return jsonify({"success": True, "message": "Values updated"}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -0,0 +1,41 @@
+-- One cart line per (session, product, size, color), written with a single atomic upsert
+-- Replaces select-then-insert in add_to_cart, which raced under double clicks and created duplicates
+
+-- Merge existing duplicate lines into the oldest one before adding the constraint
+WITH ranked AS (
+    SELECT id,
+           FIRST_VALUE(id) OVER w AS keep_id,
+           SUM(quantity) OVER (PARTITION BY session_id, product_id, size, color) AS total_quantity
+    FROM public.cart_items
+    WINDOW w AS (PARTITION BY session_id, product_id, size, color ORDER BY created_at, id)
+),
+merged AS (
+    UPDATE public.cart_items c
+    SET quantity = r.total_quantity
+    FROM ranked r
+    WHERE c.id = r.id AND r.id = r.keep_id
+)
+DELETE FROM public.cart_items c
+USING ranked r
+WHERE c.id = r.id AND r.id <> r.keep_id;
+
+-- Size and color may be NULL; NULLS NOT DISTINCT makes those lines unique too (Postgres 15+)
+CREATE UNIQUE INDEX IF NOT EXISTS cart_items_line_key
+    ON public.cart_items (session_id, product_id, size, color) NULLS NOT DISTINCT;
+
+-- Add items to a session's cart, incrementing the quantity of lines that already exist
+-- p_items: JSON array of {product_id, size, color, quantity}; unknown products are skipped
+-- Returns the resulting cart lines
+CREATE OR REPLACE FUNCTION public.add_cart_items(p_session_id TEXT, p_items JSONB)
+RETURNS TABLE (id UUID, product_id UUID, size TEXT, color TEXT, quantity INTEGER)
+LANGUAGE sql
+AS $$
+    INSERT INTO public.cart_items AS c (session_id, product_id, size, color, quantity, price)
+    SELECT p_session_id, i.product_id, i.size, i.color, SUM(COALESCE(i.quantity, 1)), MIN(p.price)
+    FROM jsonb_to_recordset(p_items) AS i(product_id UUID, size TEXT, color TEXT, quantity INTEGER)
+    INNER JOIN public.products p ON p.id = i.product_id
+    GROUP BY i.product_id, i.size, i.color
+    ON CONFLICT (session_id, product_id, size, color) DO UPDATE SET
+        quantity = c.quantity + EXCLUDED.quantity
+    RETURNING c.id, c.product_id, c.size, c.color, c.quantity;
+$$;
@@ -0,0 +1,28 @@
+-- Atomic discount code redemption for checkout
+-- The usage limit, status and expiry are re-checked in the same UPDATE that counts the use,
+-- so concurrent checkouts can never push usage_count past usage_limit
+
+-- Count one use of a discount; returns the new usage_count, or no row if it can't be used
+CREATE OR REPLACE FUNCTION public.redeem_discount(p_discount_id public.discounts.id%TYPE)
+RETURNS TABLE (usage_count INTEGER)
+LANGUAGE sql
+AS $$
+    UPDATE public.discounts d
+    SET usage_count = COALESCE(d.usage_count, 0) + 1
+    WHERE d.id = p_discount_id
+      AND d.status = 'active'
+      AND (d.usage_limit IS NULL OR COALESCE(d.usage_count, 0) < d.usage_limit)
+      AND (d.expiration_date IS NULL OR d.expiration_date::date >= CURRENT_DATE)
+    RETURNING d.usage_count;
+$$;
+
+-- Give back a use counted by redeem_discount (when the order could not be created)
+CREATE OR REPLACE FUNCTION public.release_discount(p_discount_id public.discounts.id%TYPE)
+RETURNS TABLE (usage_count INTEGER)
+LANGUAGE sql
+AS $$
+    UPDATE public.discounts d
+    SET usage_count = GREATEST(COALESCE(d.usage_count, 0) - 1, 0)
+    WHERE d.id = p_discount_id
+    RETURNING d.usage_count;
+$$;
@@ -1,10 +1,27 @@
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef, useCallback } from "react"
 import { Star, MoreVertical, Loader2 } from "lucide-react"
 import { Button } from "@/components/ui/button"
 import { Skeleton } from "@/components/ui/skeleton"
-import { getProductReviews, addProductReview, type Review } from "@/lib/api"
+import { addProductReview, type Review } from "@/lib/api"
+
+const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:1581'
+const REVIEWS_PAGE_SIZE = 6
+
+interface ReviewsPage {
+  success: boolean
+  data?: Review[]
+  next_cursor?: string | null
+}
+
+// One page of reviews, newest first; pass the previous page's next_cursor for the following one
+async function fetchReviewsPage(productId: string, cursor?: string | null): Promise<ReviewsPage> {
+  const params = new URLSearchParams({ limit: String(REVIEWS_PAGE_SIZE) })
+  if (cursor) params.set('cursor', cursor)
+  const response = await fetch(`${API_URL}/api/products/${productId}/reviews?${params}`)
+  return response.json()
+}
 
 interface ProductReviewsProps {
   productId: string
@@ -13,30 +30,64 @@ interface ProductReviewsProps {
 export function ProductReviews({ productId }: ProductReviewsProps) {
   const [reviews, setReviews] = useState<Review[]>([])
   const [loading, setLoading] = useState(true)
-  const [visibleCount, setVisibleCount] = useState(6)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const sentinelRef = useRef<HTMLDivElement>(null)
 
   useEffect(() => {
+    let cancelled = false
+
     async function fetchReviews() {
+      setLoading(true)
+      setReviews([])
+      setNextCursor(null)
       try {
-        const response = await getProductReviews(productId)
-        if (response.success && response.data) {
+        const response = await fetchReviewsPage(productId)
+        if (!cancelled && response.success && response.data) {
           setReviews(response.data)
+          setNextCursor(response.next_cursor ?? null)
         }
       } catch (error) {
         console.error('Failed to fetch reviews:', error)
       } finally {
-        setLoading(false)
+        if (!cancelled) setLoading(false)
       }
     }
     
     if (productId) {
       fetchReviews()
     }
+    return () => {
+      cancelled = true
+    }
   }, [productId])
 
-  const loadMore = () => {
-    setVisibleCount((prev) => Math.min(prev + 6, reviews.length))
-  }
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore) return
+    setLoadingMore(true)
+    try {
+      const response = await fetchReviewsPage(productId, nextCursor)
+      if (response.success && response.data) {
+        setReviews((prev) => [...prev, ...response.data!])
+        setNextCursor(response.next_cursor ?? null)
+      }
+    } catch (error) {
+      console.error('Failed to fetch more reviews:', error)
+    } finally {
+      setLoadingMore(false)
+    }
+  }, [productId, nextCursor, loadingMore])
+
+  // Stream the next page in when the end of the list scrolls into view
+  useEffect(() => {
+    const sentinel = sentinelRef.current
+    if (!sentinel || !nextCursor) return
+    const observer = new IntersectionObserver((entries) => {
+      if (entries[0].isIntersecting) loadMore()
+    }, { rootMargin: '200px' })
+    observer.observe(sentinel)
+    return () => observer.disconnect()
+  }, [loadMore, nextCursor])
 
   const formatDate = (dateString?: string) => {
     if (!dateString) return 'Unknown date'
@@ -101,7 +152,7 @@ export function ProductReviews({ productId }: ProductReviewsProps) {
     <div>
       {/* Reviews Grid */}
       <div className="grid grid-cols-1 md:grid-cols-2 gap-6 mb-8">
-        {reviews.slice(0, visibleCount).map((review) => (
+        {reviews.map((review) => (
           <div key={review.id} className="border border-border rounded-lg p-6 space-y-3 relative">
             {/* Three dots menu */}
             <button className="absolute top-4 right-4 text-muted-foreground hover:text-foreground">
@@ -134,11 +185,11 @@ export function ProductReviews({ productId }: ProductReviewsProps) {
         ))}
       </div>
 
-      {/* Load More Button */}
-      {visibleCount < reviews.length && (
-        <div className="text-center">
-          <Button onClick={loadMore} variant="outline" className="px-12 bg-transparent">
-            Load More Reviews
+      {/* Load More Button (also triggered by scrolling to it) */}
+      {nextCursor && (
+        <div ref={sentinelRef} className="text-center">
+          <Button onClick={loadMore} disabled={loadingMore} variant="outline" className="px-12 bg-transparent">
+            {loadingMore ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load More Reviews"}
           </Button>
         </div>
       )}
@@ -0,0 +1,66 @@
+-- Registry of product categories with their active-product counts
+-- Maintained by a trigger on products so the categories endpoint never scans products
+-- Only products with status 'active' and a non-empty category are counted
+
+CREATE TABLE IF NOT EXISTS public.product_category_counts (
+    category TEXT PRIMARY KEY,
+    active_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Add delta to one category's count (no-op for inactive or uncategorised products)
+CREATE OR REPLACE FUNCTION public.bump_product_category_count(p_category TEXT, p_status TEXT, p_delta INTEGER)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO public.product_category_counts AS c (category, active_count)
+    SELECT p_category, GREATEST(p_delta, 0)
+    WHERE COALESCE(p_category, '') <> '' AND p_status = 'active'
+    ON CONFLICT (category) DO UPDATE SET
+        active_count = GREATEST(c.active_count + p_delta, 0),
+        updated_at = NOW();
+$$;
+
+CREATE OR REPLACE FUNCTION public.track_product_category_counts()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM public.bump_product_category_count(OLD.category, OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM public.bump_product_category_count(NEW.category, NEW.status, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS products_category_counts ON public.products;
+CREATE TRIGGER products_category_counts
+    AFTER INSERT OR DELETE OR UPDATE OF category, status ON public.products
+    FOR EACH ROW EXECUTE FUNCTION public.track_product_category_counts();
+
+-- Reconcile the registry from the products table (repairs any drift)
+CREATE OR REPLACE FUNCTION public.rebuild_product_category_counts()
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt INTEGER;
+BEGIN
+    DELETE FROM public.product_category_counts;
+
+    INSERT INTO public.product_category_counts (category, active_count)
+    SELECT p.category, COUNT(*)
+    FROM public.products p
+    WHERE p.status = 'active' AND COALESCE(p.category, '') <> ''
+    GROUP BY p.category;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+-- Initial population
+SELECT public.rebuild_product_category_counts();
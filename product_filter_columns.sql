@@ -0,0 +1,34 @@
+-- Case-normalized shadow columns for the JSONB color/tags arrays
+-- Lets the product filter compiler push color/tag filters into PostgREST
+-- as array containment (cs) instead of filtering rows in Python
+
+-- Lowercase text[] from a JSONB array (or a bare JSONB string)
+CREATE OR REPLACE FUNCTION public.jsonb_lower_text_array(value JSONB)
+RETURNS TEXT[]
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE jsonb_typeof(value)
+        WHEN 'array' THEN COALESCE(
+            (SELECT array_agg(lower(elem)) FROM jsonb_array_elements_text(value) AS elem),
+            '{}'::TEXT[]
+        )
+        WHEN 'string' THEN ARRAY[lower(value #>> '{}')]
+        ELSE '{}'::TEXT[]
+    END;
+$$;
+
+ALTER TABLE public.products
+    ADD COLUMN IF NOT EXISTS color_lc TEXT[]
+        GENERATED ALWAYS AS (public.jsonb_lower_text_array(color)) STORED;
+
+ALTER TABLE public.products
+    ADD COLUMN IF NOT EXISTS tags_lc TEXT[]
+        GENERATED ALWAYS AS (public.jsonb_lower_text_array(tags)) STORED;
+
+CREATE INDEX IF NOT EXISTS products_color_lc_idx ON public.products USING GIN (color_lc);
+CREATE INDEX IF NOT EXISTS products_tags_lc_idx ON public.products USING GIN (tags_lc);
+
+-- Keyset-friendly indexes for the listing sorts
+CREATE INDEX IF NOT EXISTS products_status_created_at_idx ON public.products (status, created_at DESC, id);
+CREATE INDEX IF NOT EXISTS products_status_price_idx ON public.products (status, price, id);
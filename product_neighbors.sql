@@ -0,0 +1,29 @@
+-- Precomputed related products: the top-K most similar active products per product
+-- Similarity (category, tags, colors, price band) is computed by the backend
+-- (POST /api/admin/products/rebuild-neighbors, and per product on product writes);
+-- the related products endpoint is then a single keyed lookup
+
+CREATE TABLE IF NOT EXISTS public.product_neighbors (
+    product_id UUID NOT NULL REFERENCES public.products(id) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    neighbor_id UUID NOT NULL REFERENCES public.products(id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (product_id, rank)
+);
+
+CREATE INDEX IF NOT EXISTS product_neighbors_neighbor_idx ON public.product_neighbors (neighbor_id);
+
+-- Atomically replace the neighbor lists of a batch of products
+-- p_rows: JSON array of {product_id, neighbor_id, rank, score}
+CREATE OR REPLACE FUNCTION public.replace_product_neighbors(p_product_ids UUID[], p_rows JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    DELETE FROM public.product_neighbors WHERE product_id = ANY(p_product_ids);
+
+    INSERT INTO public.product_neighbors (product_id, rank, neighbor_id, score)
+    SELECT r.product_id, r.rank, r.neighbor_id, r.score
+    FROM jsonb_to_recordset(p_rows) AS r(product_id UUID, rank INTEGER, neighbor_id UUID, score REAL)
+    WHERE EXISTS (SELECT 1 FROM public.products p WHERE p.id = r.neighbor_id);
+$$;
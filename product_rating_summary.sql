@@ -0,0 +1,103 @@
+-- Per-product rating summary (sum, count and 1-5 star histogram)
+-- Listing and detail endpoints read this table instead of scanning every review row
+
+CREATE TABLE IF NOT EXISTS public.product_rating_summaries (
+    product_id UUID PRIMARY KEY REFERENCES public.products(id) ON DELETE CASCADE,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    star_1 INTEGER NOT NULL DEFAULT 0,
+    star_2 INTEGER NOT NULL DEFAULT 0,
+    star_3 INTEGER NOT NULL DEFAULT 0,
+    star_4 INTEGER NOT NULL DEFAULT 0,
+    star_5 INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Incrementally apply one new review to the summary (called by add_product_review)
+CREATE OR REPLACE FUNCTION public.increment_product_rating(p_product_id UUID, p_rating INTEGER)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO public.product_rating_summaries AS s
+        (product_id, rating_sum, rating_count, star_1, star_2, star_3, star_4, star_5)
+    VALUES (
+        p_product_id, p_rating, 1,
+        (p_rating = 1)::int, (p_rating = 2)::int, (p_rating = 3)::int,
+        (p_rating = 4)::int, (p_rating = 5)::int
+    )
+    ON CONFLICT (product_id) DO UPDATE SET
+        rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+        rating_count = s.rating_count + 1,
+        star_1 = s.star_1 + EXCLUDED.star_1,
+        star_2 = s.star_2 + EXCLUDED.star_2,
+        star_3 = s.star_3 + EXCLUDED.star_3,
+        star_4 = s.star_4 + EXCLUDED.star_4,
+        star_5 = s.star_5 + EXCLUDED.star_5,
+        updated_at = NOW();
+$$;
+
+-- Reconcile the summary table from the reviews table (repairs any drift)
+CREATE OR REPLACE FUNCTION public.rebuild_product_rating_summaries()
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt INTEGER;
+BEGIN
+    DELETE FROM public.product_rating_summaries;
+
+    INSERT INTO public.product_rating_summaries
+        (product_id, rating_sum, rating_count, star_1, star_2, star_3, star_4, star_5)
+    SELECT
+        r.product_id,
+        SUM(r.rating),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE r.rating = 1),
+        COUNT(*) FILTER (WHERE r.rating = 2),
+        COUNT(*) FILTER (WHERE r.rating = 3),
+        COUNT(*) FILTER (WHERE r.rating = 4),
+        COUNT(*) FILTER (WHERE r.rating = 5)
+    FROM public.reviews r
+    INNER JOIN public.products p ON p.id = r.product_id
+    WHERE r.rating BETWEEN 1 AND 5
+    GROUP BY r.product_id;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+-- Recompute the summaries of some products from the reviews table (after a bulk import)
+-- Returns the new sum and count of every given product (0 when it has no reviews)
+CREATE OR REPLACE FUNCTION public.refresh_product_rating_summaries(p_product_ids UUID[])
+RETURNS TABLE (product_id UUID, rating_sum INTEGER, rating_count INTEGER)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM public.product_rating_summaries s WHERE s.product_id = ANY(p_product_ids);
+
+    INSERT INTO public.product_rating_summaries
+        (product_id, rating_sum, rating_count, star_1, star_2, star_3, star_4, star_5)
+    SELECT
+        r.product_id,
+        SUM(r.rating),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE r.rating = 1),
+        COUNT(*) FILTER (WHERE r.rating = 2),
+        COUNT(*) FILTER (WHERE r.rating = 3),
+        COUNT(*) FILTER (WHERE r.rating = 4),
+        COUNT(*) FILTER (WHERE r.rating = 5)
+    FROM public.reviews r
+    INNER JOIN public.products p ON p.id = r.product_id
+    WHERE r.product_id = ANY(p_product_ids) AND r.rating BETWEEN 1 AND 5
+    GROUP BY r.product_id;
+
+    RETURN QUERY
+    SELECT ids.id, COALESCE(s.rating_sum, 0), COALESCE(s.rating_count, 0)
+    FROM unnest(p_product_ids) AS ids(id)
+    LEFT JOIN public.product_rating_summaries s ON s.product_id = ids.id;
+END;
+$$;
+
+-- Initial population
+SELECT public.rebuild_product_rating_summaries();
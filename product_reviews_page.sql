@@ -0,0 +1,44 @@
+-- Keyset pagination for a product's reviews, newest first
+-- Pages are ordered by (posted_date, created_at, id) descending; the cursor is the last row's key,
+-- so every page is an index range scan no matter how deep the reader scrolls
+
+-- The key columns must not be NULL: a NULL never compares less than the cursor, so those
+-- reviews would drop out of every page after the first (or end paging at a NULL cursor)
+UPDATE public.reviews SET created_at = NOW() WHERE created_at IS NULL;
+UPDATE public.reviews SET posted_date = created_at WHERE posted_date IS NULL;
+
+ALTER TABLE public.reviews
+    ALTER COLUMN created_at SET DEFAULT NOW(),
+    ALTER COLUMN created_at SET NOT NULL,
+    ALTER COLUMN posted_date SET DEFAULT NOW(),
+    ALTER COLUMN posted_date SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS reviews_product_posted_idx
+    ON public.reviews (product_id, posted_date, created_at, id);
+
+CREATE INDEX IF NOT EXISTS reviews_product_rating_posted_idx
+    ON public.reviews (product_id, rating, posted_date, created_at, id);
+
+-- One page of reviews after the given key (first page when p_after_id is NULL)
+-- p_rating: only reviews with this rating (NULL for all)
+CREATE OR REPLACE FUNCTION public.product_reviews_page(
+    p_product_id public.reviews.product_id%TYPE,
+    p_limit INTEGER,
+    p_rating INTEGER DEFAULT NULL,
+    p_after_posted_date public.reviews.posted_date%TYPE DEFAULT NULL,
+    p_after_created_at public.reviews.created_at%TYPE DEFAULT NULL,
+    p_after_id public.reviews.id%TYPE DEFAULT NULL
+)
+RETURNS SETOF public.reviews
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT r.*
+    FROM public.reviews r
+    WHERE r.product_id = p_product_id
+      AND (p_rating IS NULL OR r.rating = p_rating)
+      AND (p_after_id IS NULL
+           OR (r.posted_date, r.created_at, r.id) < (p_after_posted_date, p_after_created_at, p_after_id))
+    ORDER BY r.posted_date DESC, r.created_at DESC, r.id DESC
+    LIMIT p_limit;
+$$;
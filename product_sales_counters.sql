@@ -0,0 +1,95 @@
+-- Per-product units sold, maintained incrementally from orders
+-- Best-selling rankings read this table instead of summing every order_items row
+-- Orders with status 'cancelled' or 'returned' do not count as sales
+
+CREATE TABLE IF NOT EXISTS public.product_sales_counters (
+    product_id UUID PRIMARY KEY,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS product_sales_counters_units_idx
+    ON public.product_sales_counters (units_sold DESC);
+
+-- Add (p_sign = 1) or remove (p_sign = -1) one order's items from the counters
+-- A removal never creates a counter (it would start out negative), it only lowers existing ones
+-- Returns the new totals of the affected products
+CREATE OR REPLACE FUNCTION public.apply_order_sales(p_order_id UUID, p_sign INTEGER)
+RETURNS TABLE (product_id UUID, units_sold INTEGER)
+LANGUAGE sql
+AS $$
+    INSERT INTO public.product_sales_counters AS c (product_id, units_sold)
+    SELECT oi.product_id, p_sign * SUM(COALESCE(oi.quantity, 1))
+    FROM public.order_items oi
+    WHERE oi.order_id = p_order_id AND oi.product_id IS NOT NULL
+      AND (p_sign > 0 OR EXISTS (
+          SELECT 1 FROM public.product_sales_counters e WHERE e.product_id = oi.product_id
+      ))
+    GROUP BY oi.product_id
+    ON CONFLICT (product_id) DO UPDATE SET
+        units_sold = GREATEST(c.units_sold + EXCLUDED.units_sold, 0),
+        updated_at = NOW()
+    RETURNING c.product_id, c.units_sold;
+$$;
+
+-- Change an order's status, and add or remove its items when it starts or stops being a sale
+-- The order row is locked first, so concurrent changes (a double-clicked cancel) run one
+-- after the other and each compares against the status the previous one left
+-- Returns {"order": updated row (null if not found), "sales": new totals of the affected products}
+CREATE OR REPLACE FUNCTION public.set_order_status(
+    p_order_id public.orders.id%TYPE,
+    p_status public.orders.status%TYPE
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    previous public.orders.status%TYPE;
+    updated public.orders;
+    was_sale BOOLEAN;
+    is_sale BOOLEAN;
+    sales JSONB := '[]'::jsonb;
+BEGIN
+    SELECT o.status INTO previous FROM public.orders o WHERE o.id = p_order_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('order', NULL, 'sales', sales);
+    END IF;
+
+    UPDATE public.orders o SET status = p_status WHERE o.id = p_order_id RETURNING o.* INTO updated;
+
+    was_sale := COALESCE(previous, '') NOT IN ('cancelled', 'returned');
+    is_sale := COALESCE(p_status, '') NOT IN ('cancelled', 'returned');
+    IF was_sale <> is_sale THEN
+        SELECT COALESCE(jsonb_agg(to_jsonb(s)), '[]'::jsonb) INTO sales
+        FROM public.apply_order_sales(p_order_id, CASE WHEN is_sale THEN 1 ELSE -1 END) s;
+    END IF;
+
+    RETURN jsonb_build_object('order', to_jsonb(updated), 'sales', sales);
+END;
+$$;
+
+-- Reconcile the counters from order_items (repairs any drift)
+CREATE OR REPLACE FUNCTION public.rebuild_product_sales_counters()
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rebuilt INTEGER;
+BEGIN
+    DELETE FROM public.product_sales_counters;
+
+    INSERT INTO public.product_sales_counters (product_id, units_sold)
+    SELECT oi.product_id, SUM(COALESCE(oi.quantity, 1))
+    FROM public.order_items oi
+    INNER JOIN public.orders o ON o.id = oi.order_id
+    WHERE oi.product_id IS NOT NULL
+      AND COALESCE(o.status, '') NOT IN ('cancelled', 'returned')
+    GROUP BY oi.product_id;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$;
+
+-- Initial population
+SELECT public.rebuild_product_sales_counters();
@@ -0,0 +1,40 @@
+import app as shop
+
+
+def make_product(product_id, category, price=100):
+    return {
+        'id': product_id,
+        'name': f'Product {product_id}',
+        'price': price,
+        'category': category,
+        'color': ['Blue'],
+        'tags': ['new'],
+        'status': 'active',
+        'created_at': '2026-01-01T00:00:00',
+    }
+
+
+def make_catalog():
+    products = [
+        make_product('p1', 'Shirts'),
+        make_product('p2', None),
+        make_product('p3', ''),
+    ]
+    return shop.CatalogSnapshot(products, {})
+
+
+def test_facets_skip_products_without_category():
+    facets = make_catalog().facets()
+
+    assert facets['total'] == 3
+    assert facets['categories'] == {'Shirts': 1}
+
+
+def test_facets_endpoint_with_uncategorized_product(monkeypatch):
+    monkeypatch.setattr(shop, 'get_catalog_snapshot', make_catalog)
+    shop._response_cache.clear()
+
+    response = shop.app.test_client().get('/api/products/facets')
+
+    assert response.status_code == 200
+    assert response.get_json()['data']['categories'] == {'Shirts': 1}
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import app as shop
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.deleting = False
+
+    def select(self, *columns):
+        return self
+
+    def delete(self):
+        self.deleting = True
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, value))
+        return self
+
+    def matches(self, row):
+        return all(row.get(column) == value for column, value in self.filters)
+
+    def execute(self):
+        rows = self.db.tables[self.table]
+        matched = [row for row in rows if self.matches(row)]
+        if self.deleting:
+            self.db.tables[self.table] = [row for row in rows if not self.matches(row)]
+            if self.table == 'products':
+                # product_neighbors references products ON DELETE CASCADE
+                deleted = {row['id'] for row in matched}
+                self.db.tables['product_neighbors'] = [
+                    row for row in self.db.tables['product_neighbors']
+                    if row['product_id'] not in deleted and row['neighbor_id'] not in deleted
+                ]
+        return SimpleNamespace(data=matched)
+
+
+class FakeSupabase:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def make_product(product_id, category='Shirts'):
+    return {
+        'id': product_id,
+        'name': f'Product {product_id}',
+        'price': 100,
+        'category': category,
+        'color': ['Blue'],
+        'tags': [],
+        'status': 'active',
+        'created_at': '2026-01-01T00:00:00',
+    }
+
+
+def test_delete_recomputes_lists_that_included_the_product(monkeypatch):
+    products = [make_product('p1'), make_product('p2'), make_product('p3')]
+    db = FakeSupabase({
+        'products': products,
+        'product_neighbors': [
+            {'product_id': 'p2', 'rank': 0, 'neighbor_id': 'p1'},
+            {'product_id': 'p3', 'rank': 0, 'neighbor_id': 'p1'},
+            {'product_id': 'p3', 'rank': 1, 'neighbor_id': 'p2'},
+        ],
+    })
+    rebuilt = []
+    invalidated = set()
+    monkeypatch.setattr(shop, 'supabase', db)
+    monkeypatch.setattr(shop, 'refresh_catalog_snapshot', lambda: None)
+    monkeypatch.setattr(shop, 'get_product_similarity',
+                        lambda: shop.ProductSimilarity(shop.CatalogSnapshot(db.tables['products'], {})))
+    monkeypatch.setattr(shop, 'rebuild_product_neighbors', rebuilt.extend)
+    monkeypatch.setattr(shop, 'invalidate_response_cache', lambda *tags: invalidated.update(tags))
+
+    response = shop.app.test_client().delete('/api/admin/products/p1')
+
+    assert response.status_code == 200
+    assert [p['id'] for p in db.tables['products']] == ['p2', 'p3']
+    assert {'p2', 'p3'} <= set(rebuilt)
+    assert {'product:p1', 'product:p2', 'product:p3'} <= invalidated